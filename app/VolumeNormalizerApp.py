@@ -1,16 +1,26 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, scrolledtext, Menu
 import tkinter.ttk as ttk
-from pydub import AudioSegment
-from mutagen.id3 import ID3, ID3NoHeaderError
 from PIL import Image, ImageTk
 import os
-import numpy as np
-import tempfile
-import shutil
 import sys
 import subprocess
 import json
+import multiprocessing
+import queue
+
+import timing
+from analysis_cache import AnalysisCache
+from pcm_scratch import DEFAULT_BUDGET_MB
+from console_log import ConsoleLog
+from output_staging import cleanup_orphans
+from song_table import SongTable
+from core import (
+    ANALYZER_VERSION, AUDIO_EXTENSIONS, MAX_TARGET_LUFS, MIN_TARGET_LUFS, MODES, BackgroundTask, TargetSet,
+    album_task, analysis_task, default_workers, folder_scan_task, loudness_measured, normalize_task, output_paths_for,
+    plan_target,
+)
+
 # ---------------------- CARGA DE IDIOMA ----------------------
 def load_language(lang_code="es"):
     try:
@@ -43,98 +53,13 @@ def resource_path(relative_path):
         base_path = os.path.abspath(os.path.dirname(__file__))
     return os.path.join(base_path, relative_path)
 
-# ---------------------- FUNCIONES DE AUDIO ----------------------
-
-def get_rms(audio):
-    samples = np.array(audio.get_array_of_samples())
-    return np.sqrt(np.mean(samples.astype(np.float64) ** 2))
-
-def analyze_lufs(path):
-    try:
-        cmd = [
-            "ffmpeg", "-hide_banner", "-nostats", "-i", path,
-            "-af", "loudnorm=I=-16:TP=-1.5:LRA=11:print_format=json",
-            "-f", "null", "-"
-        ]
-        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        output = result.stderr
-
-        # Buscar el bloque JSON que contiene los resultados
-        start = output.find("{")
-        end = output.rfind("}")
-        if start != -1 and end != -1:
-            data = json.loads(output[start:end+1])
-            return round(float(data.get("input_i", -99)), 2)
-        return None
-    except Exception as e:
-        print(f"Error analyzing LUFS: {e}")
-        return None
-    
-def analyze_lufs_rms(path):
-    try:
-        # Obtener LUFS usando ffmpeg
-        cmd = [
-            "ffmpeg", "-hide_banner", "-nostats", "-i", path,
-            "-af", "loudnorm=I=-16:TP=-1.5:LRA=11:print_format=json",
-            "-f", "null", "-"
-        ]
-        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        output = result.stderr
-
-        # Extraer JSON
-        start = output.find("{")
-        end = output.rfind("}")
-        lufs = None
-        if start != -1 and end != -1:
-            data = json.loads(output[start:end+1])
-            lufs = round(float(data.get("input_i", -99)), 2)
-
-        # Obtener RMS con pydub
-        audio = AudioSegment.from_mp3(path)
-        rms = round(get_rms(audio), 4)
-
-        return lufs, rms
-    except Exception as e:
-        print(f"Error analyzing LUFS and RMS: {e}")
-        return None, None
-
-
-def apply_metadata(src_path, dst_path):
-    try:
-        src_tags = ID3(src_path)
-        try:
-            dst_tags = ID3(dst_path)
-        except ID3NoHeaderError:
-            dst_tags = ID3()
-        dst_tags.clear()
-        for frame in src_tags.values():
-            dst_tags.add(frame)
-        dst_tags.save(dst_path)
-    except Exception as e:
-        print(f"Error copying metadata: {e}")
-
-def normalize_with_ffmpeg_loudnorm(input_path, output_path, target_lufs=-16.0):
-    try:
-        tmp_out = tempfile.mktemp(suffix=".mp3")
-        norm_cmd = [
-            "ffmpeg", "-y",
-            "-i", input_path,
-            "-af", f"loudnorm=I={target_lufs}:TP=-1.5:LRA=11",
-            "-ar", "44100",
-            "-ac", "2",
-            "-b:a", "192k",
-            tmp_out
-        ]
-        startup_flags = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
-        subprocess.run(norm_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, creationflags=startup_flags)
-        shutil.move(tmp_out, output_path)
-        return True
-    except Exception as e:
-        print(f"Error in loudnorm: {e}")
-        return False
-
 # ---------------------- APP PRINCIPAL ----------------------
 
+POLL_MS = 50
+MAX_EVENTS_PER_POLL = 200
+# Espera tras teclear el objetivo antes de recalcular la columna de ganancia
+RETARGET_MS = 300
+
 class VolumeNormalizerApp:
     def __init__(self, root):
         self.root = root
@@ -153,8 +78,31 @@ class VolumeNormalizerApp:
         except Exception as e:
             print(f"No se pudo cargar el ícono: {e}")
 
-        self.target_paths = []
+        self.target_paths = TargetSet()
+        # Carpetas añadidas: su estructura se refleja en la carpeta de salida
+        self.input_folders = []
+        self.analyses = {}
+        self.pending_analysis = set()
         self.output_folder = None
+        self.retarget_pending = None
+        self.profile_var = tk.BooleanVar(value=False)
+
+        # Trabajo en segundo plano: los hilos publican eventos en esta cola
+        self.events = queue.Queue()
+        self.tasks = []
+        self.batch = None
+
+        # Caché persistente de análisis (opcional: si falla se analiza siempre)
+        try:
+            self.analysis_cache = AnalysisCache(analyzer_version=ANALYZER_VERSION)
+        except Exception as e:
+            print(f"Could not open analysis cache: {e}")
+            self.analysis_cache = None
+        # Caché PCM en disco opcional (VOLUMATCH_SCRATCH=carpeta): cada archivo
+        # se decodifica una sola vez para analizarlo y codificarlo
+        scratch_folder = os.environ.get("VOLUMATCH_SCRATCH")
+        self.scratch = {"folder": scratch_folder, "budget_mb": DEFAULT_BUDGET_MB} if scratch_folder else None
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
         # Estilos
         style = ttk.Style()
@@ -178,8 +126,38 @@ class VolumeNormalizerApp:
         self.lufs_entry = ttk.Entry(top_frame, width=6)
         self.lufs_entry.insert(0, "-16")
         self.lufs_entry.pack(side="left", padx=(0, 5))
+        self.lufs_entry.bind("<KeyRelease>", self.on_target_changed)
         ttk.Button(top_frame, text="ℹ️", width=3, command=self.show_lufs_info).pack(side="left", padx=(0, 15))
-        ttk.Button(top_frame, text=self.lang["normalize"], command=self.normalize).pack(side="left")
+        self.workers_label = ttk.Label(top_frame, text=self.lang["workers_label"])
+        self.workers_label.pack(side="left", padx=(0, 5))
+        self.workers_entry = ttk.Spinbox(top_frame, from_=1, to=max(64, default_workers()), width=4)
+        self.workers_entry.set(default_workers())
+        self.workers_entry.pack(side="left", padx=(0, 15))
+        self.normalize_button = ttk.Button(top_frame, text=self.lang["normalize"], command=self.normalize)
+        self.normalize_button.pack(side="left")
+        self.cancel_button = ttk.Button(top_frame, text=self.lang["cancel"], command=self.cancel_tasks, state="disabled")
+        self.cancel_button.pack(side="left", padx=(5, 0))
+
+        # Modo de salida: recodificar con loudnorm o ganancia MP3 sin pérdida
+        mode_frame = ttk.Frame(root)
+        mode_frame.pack(pady=(0, 10))
+        self.mode_label = ttk.Label(mode_frame, text=self.lang["mode_label"])
+        self.mode_label.pack(side="left", padx=(0, 5))
+        self.mode_combo = ttk.Combobox(mode_frame, state="readonly", width=32)
+        self.mode_combo["values"] = [self.lang["modes"][mode] for mode in MODES]
+        self.mode_combo.current(0)
+        self.mode_combo.pack(side="left")
+        self.mode_combo.bind("<<ComboboxSelected>>", self.on_target_changed)
+        # Tolerancia en LU: los temas ya cerca del objetivo se copian sin procesar
+        self.tolerance_label = ttk.Label(mode_frame, text=self.lang["tolerance_label"])
+        self.tolerance_label.pack(side="left", padx=(15, 5))
+        self.tolerance_entry = ttk.Spinbox(mode_frame, from_=0.0, to=3.0, increment=0.1, width=4)
+        self.tolerance_entry.set("0.0")
+        self.tolerance_entry.pack(side="left")
+        # Modo álbum: una ganancia común por álbum en lugar de por tema
+        self.album_var = tk.BooleanVar(value=False)
+        self.album_check = ttk.Checkbutton(mode_frame, text=self.lang["album_label"], variable=self.album_var)
+        self.album_check.pack(side="left", padx=(15, 0))
 
         # Barra de progreso
         self.progress = ttk.Progressbar(root, orient="horizontal", length=400, mode="determinate")
@@ -191,16 +169,75 @@ class VolumeNormalizerApp:
         self.console = scrolledtext.ScrolledText(console_frame, height=12, width=90, state='disabled', bg="#111", fg="#0f0")
         self.console.configure(font=("Consolas", 10))
         self.console.pack(fill="both", expand=True)
+        # Búfer con volcado periódico y scrollback acotado; VOLUMATCH_LOG
+        # copia además la consola a un archivo rotativo
+        self.console_log = ConsoleLog(self.root, self.console, log_path=os.environ.get("VOLUMATCH_LOG"))
 
         # Cargar logo (después de la consola)
         self.mostrar_logo()
 
+        self.root.after(POLL_MS, self.poll_events)
+
+    def on_close(self):
+        self.cancel_tasks()
+        if self.analysis_cache is not None:
+            self.analysis_cache.close()
+        self.console_log.close()
+        self.root.destroy()
+
     def log(self, message):
-        self.console.configure(state='normal')
-        self.console.insert(tk.END, message + '\n')
-        self.console.see(tk.END)
-        self.console.configure(state='disabled')
-        self.console.update_idletasks()
+        self.console_log.write(message)
+
+    # ---------------------- EVENTOS DE SEGUNDO PLANO ----------------------
+
+    def start_task(self, work, *args):
+        task = BackgroundTask(self.events, work, *args)
+        self.tasks.append(task)
+        self.cancel_button.config(state="normal")
+        return task
+
+    def cancel_tasks(self):
+        for task in self.tasks:
+            task.cancel()
+
+    def poll_events(self):
+        # Se procesa un número acotado de eventos por ciclo para que la
+        # ventana siga respondiendo aunque lleguen miles de resultados
+        for _ in range(MAX_EVENTS_PER_POLL):
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                break
+            handler = getattr(self, "on_" + event[0])
+            handler(*event[1:])
+
+        self.tasks = [task for task in self.tasks if task.thread.is_alive()]
+        if not self.tasks:
+            self.cancel_button.config(state="disabled")
+        self.root.after(POLL_MS, self.poll_events)
+
+    def selected_mode(self):
+        return MODES[max(0, self.mode_combo.current())]
+
+    def target_lufs(self):
+        # Fuera del rango de loudnorm fallarían todos los archivos
+        try:
+            target = float(self.lufs_entry.get())
+        except ValueError:
+            return None
+        return target if MIN_TARGET_LUFS <= target <= MAX_TARGET_LUFS else None
+
+    def tolerance(self):
+        try:
+            return max(0.0, float(self.tolerance_entry.get()))
+        except ValueError:
+            return 0.0
+
+    def worker_count(self):
+        try:
+            return max(1, int(self.workers_entry.get()))
+        except ValueError:
+            return default_workers()
 
     def mostrar_logo(self):
         logo_frame = tk.Frame(self.root)
@@ -225,6 +262,14 @@ class VolumeNormalizerApp:
 
     def refresh_texts(self):
         self.root.title(self.lang["title"])
+        self.workers_label.config(text=self.lang["workers_label"])
+        self.mode_label.config(text=self.lang["mode_label"])
+        self.tolerance_label.config(text=self.lang["tolerance_label"])
+        self.album_check.config(text=self.lang["album_label"])
+        mode_index = self.mode_combo.current()
+        self.mode_combo["values"] = [self.lang["modes"][mode] for mode in MODES]
+        self.mode_combo.current(mode_index)
+        self.cancel_button.config(text=self.lang["cancel"])
 
         # Destruir ventana secundaria antes de modificar widgets ligados a ella
         if hasattr(self, "excel_win") and self.excel_win.winfo_exists():
@@ -269,24 +314,25 @@ class VolumeNormalizerApp:
         self.excel_win.title(self.lang["excel_page"]["title"])
         self.excel_win.grab_set()
 
-        self.tree = ttk.Treeview(
-            self.excel_win, columns=(self.lang["excel_page"]["archive"], self.lang["excel_page"]["duration"], "RMS", "LUFS"),
-            show="headings", selectmode="extended"
-        )
-        for col in (self.lang["excel_page"]["archive"], self.lang["excel_page"]["duration"], "RMS", "LUFS"):
-
-
-            self.tree.heading(col, text=col)
-            self.tree.column(col, width=250 if col == self.lang["excel_page"]["archive"] else 100)
+        archive = self.lang["excel_page"]["archive"]
+        profile = self.lang["excel_page"]["profile"]
+        columns = (archive, self.lang["excel_page"]["duration"], "RMS", "LUFS", self.lang["excel_page"]["gain"], profile)
+        widths = {archive: 250, profile: 180}
+        # Tabla virtual: solo existen en Tk las filas visibles
+        self.tree = SongTable(self.excel_win, columns, [widths.get(col, 100) for col in columns])
         self.tree.pack(expand=True, fill="both")
+        self.show_profile_column()
         self.tree.bind("<Button-3>", self.show_context_menu)
 
         btn_frame = tk.Frame(self.excel_win)
         btn_frame.pack(pady=5)
 
         tk.Button(btn_frame, text=self.lang["excel_page"]["aggregate"], command=self.select_targets).pack(side="left", padx=5)
+        tk.Button(btn_frame, text=self.lang["excel_page"]["add folder"], command=self.select_folder).pack(side="left", padx=5)
         tk.Button(btn_frame, text=self.lang["excel_page"]["delete selected"], command=self.delete_selected).pack(side="left", padx=5)
         tk.Button(btn_frame, text=self.lang["excel_page"]["delete all"], command=self.clear_all).pack(side="left", padx=5)
+        tk.Checkbutton(btn_frame, text=self.lang["excel_page"]["show profile"], variable=self.profile_var,
+                       command=self.show_profile_column).pack(side="left", padx=5)
         tk.Button(btn_frame, text=self.lang["excel_page"]["accept"], command=self.excel_win.destroy).pack(side="left", padx=15)
 
         self.populate_treeview()
@@ -294,22 +340,84 @@ class VolumeNormalizerApp:
     def populate_treeview(self):
         if not hasattr(self, "tree"):
             return
-        for item in self.tree.get_children():
-            self.tree.delete(item)
+        self.tree.clear()
+        self.add_rows(self.target_paths)
+
+    def add_rows(self, paths):
+        # Las rutas ya analizadas se insertan al momento; el resto se analiza
+        # en segundo plano y su fila aparece al llegar el resultado
+        missing = []
+        for path in paths:
+            analysis = self.analyses.get(path)
+            if analysis is not None:
+                self.insert_row(path, analysis)
+            elif path not in self.pending_analysis:
+                self.pending_analysis.add(path)
+                missing.append(path)
+        if missing:
+            self.start_task(analysis_task, missing, self.analysis_cache, self.worker_count())
+
+    def on_analysis(self, path, analysis):
+        self.pending_analysis.discard(path)
+        if path not in self.target_paths:
+            return
+        self.analyses[path] = analysis
+        self.log_analysis(path, analysis)
+        if hasattr(self, "tree") and self.tree.winfo_exists():
+            self.insert_row(path, analysis)
+
+    def on_analysis_error(self, path, error):
+        self.pending_analysis.discard(path)
+        self.log(f"{self.lang['error charging']} {path}: {error}")
+
+    def on_analysis_done(self, cancelled):
+        if cancelled:
+            self.pending_analysis.clear()
+
+    def show_profile_column(self):
+        # La curva de sonoridad es opcional: la columna existe siempre, solo
+        # cambia si se muestra
+        columns = self.tree.columns
+        self.tree.show_columns(columns if self.profile_var.get() else columns[:-1])
+
+    def insert_row(self, path, analysis):
+        duration = round(analysis["duration"], 1)
+        rms = f"{round(analysis['rms'], 2)} dBFS"
+        lufs = f"{round(analysis['lufs'], 2)} LUFS" if loudness_measured(analysis) else "N/A"
+        gain = ""
+        target_lufs = self.target_lufs()
+        if target_lufs is not None:
+            # Plan para el objetivo actual con el análisis guardado; ⚠ si el
+            # pico pasaría del techo (limitador o recorte)
+            plan = plan_target(analysis, target_lufs, self.selected_mode())
+            if plan["gain"] is not None:
+                gain = f"{plan['gain']:+.2f} dB" + (" ⚠" if plan["clips"] else "")
+        self.tree.insert(path, (path, f"{duration}s", rms, lufs, gain,
+                                analysis.get("sparkline", "")))
+
+    def on_target_changed(self, event=None):
+        # El objetivo no cambia la medición, solo la ganancia: la columna se
+        # recalcula con los análisis que ya hay, sin volver a analizar
+        if self.retarget_pending is not None:
+            self.root.after_cancel(self.retarget_pending)
+        self.retarget_pending = self.root.after(RETARGET_MS, self.retarget)
+
+    def retarget(self):
+        self.retarget_pending = None
+        if self.target_lufs() is None or not (hasattr(self, "tree") and self.tree.winfo_exists()):
+            return
         for path in self.target_paths:
-            try:
-                audio = AudioSegment.from_mp3(path)
-                duration = round(len(audio) / 1000, 1)
-                rms = round(get_rms(audio), 2)
-                lufs = analyze_lufs(path)
-                self.tree.insert("", "end", values=(path, f"{duration}s", rms, f"{lufs} LUFS" if lufs else "N/A"))
-                self.log(f"🎵 {os.path.basename(path)}")
-                self.log(f"   ⏱ {self.lang['excel_page']['duration']}: {duration}s")
-                self.log(f"   🔊 RMS: {rms}")
-                self.log(f"   📉 LUFS real: {lufs if lufs is not None else 'Error'}")
+            analysis = self.analyses.get(path)
+            if analysis is not None:
+                self.insert_row(path, analysis)
 
-            except Exception as e:
-                self.log(f"{self.lang['error charging']} {path}: {e}")
+    def log_analysis(self, path, analysis):
+        self.log(f"🎵 {os.path.basename(path)}")
+        self.log(f"   ⏱ {self.lang['excel_page']['duration']}: {round(analysis['duration'], 1)}s")
+        channels = " / ".join(str(round(value, 2)) for value in analysis["rms_channels"])
+        self.log(f"   🔊 RMS: {round(analysis['rms'], 2)} dBFS ({channels})")
+        self.log(f"   📉 LUFS real: {round(analysis['lufs'], 2)}")
+        self.log(f"   📈 True peak: {round(analysis['true_peak'], 2)} dBTP")
 
 
     def show_context_menu(self, event):
@@ -321,38 +429,47 @@ class VolumeNormalizerApp:
         menu.post(event.x_root, event.y_root)
 
     def select_targets(self):
-        files = filedialog.askopenfilenames(filetypes=[(self.lang["mp3"], "*.mp3")])
-        for f in files:
-            if f not in self.target_paths:
-                self.target_paths.append(f)
-        self.populate_treeview()
+        patterns = " ".join("*" + ext for ext in AUDIO_EXTENSIONS)
+        files = filedialog.askopenfilenames(filetypes=[(self.lang["audio_files"], patterns), (self.lang["mp3"], "*.mp3")])
+        self.add_rows(self.target_paths.extend(files))
+
+    def select_folder(self):
+        # Carpeta completa con subcarpetas; el recorrido va en segundo plano
+        folder = filedialog.askdirectory()
+        if folder:
+            self.start_task(folder_scan_task, folder)
+
+    def on_folder_scanned(self, folder, paths):
+        if folder not in self.input_folders:
+            self.input_folders.append(folder)
+        new_paths = self.target_paths.extend(paths)
+        self.log(f"📂 {len(new_paths)} {self.lang['folder_added']} {folder}")
+        self.add_rows(new_paths)
 
     def delete_selected(self):
         selected = self.tree.selection()
-        for item in selected:
-            path = self.tree.item(item)['values'][0]
-            if path in self.target_paths:
-                self.target_paths.remove(path)
-            self.tree.delete(item)
+        for path in selected:
+            self.target_paths.discard(path)
+            self.analyses.pop(path, None)
+        self.tree.remove_many(selected)
 
     def clear_all(self):
-        for item in self.tree.get_children():
-            self.tree.delete(item)
+        self.tree.clear()
         self.target_paths.clear()
+        self.analyses.clear()
+        self.input_folders.clear()
 
     def remove_from_treeview(self, filepath):
         if not hasattr(self, "tree"):
             return
-        for item in self.tree.get_children():
-            values = self.tree.item(item)['values']
-            if values and values[0] == filepath:
-                self.tree.delete(item)
-                break
+        self.tree.remove(filepath)
 
     def select_output_folder(self):
         folder = filedialog.askdirectory()
         if folder:
             self.output_folder = folder
+            # Restos de una ejecución interrumpida (.volumatch-*.part*)
+            cleanup_orphans(folder)
             self.log(f"{self.lang['output_folder']}: {folder}")
             messagebox.showinfo(self.lang["output_folder"], f"{self.lang['selected_folder']}:\n{folder}")
 
@@ -372,72 +489,117 @@ class VolumeNormalizerApp:
 
 
     def normalize(self):
-        if not self.target_paths or not self.output_folder:
+        mode = self.selected_mode()
+        # El modo de etiquetas escribe en los archivos originales
+        if not self.target_paths or (not self.output_folder and mode != "tags"):
             messagebox.showerror(self.lang["messagebox_error"], self.lang["messagebox_error_text"])
             return
+        if self.batch is not None:
+            return
 
-        total = len(self.target_paths)
-        self.progress["maximum"] = total
+        target_lufs = self.target_lufs()
+        if target_lufs is None:
+            self.log(self.lang["invalid_lufs"])
+            target_lufs = -16.0
+        workers = self.worker_count()
+        tolerance = self.tolerance()
+
+        paths = list(self.target_paths)
+        outputs = output_paths_for(paths, mode, self.output_folder, self.input_folders)
+        jobs = []
+        for path in paths:
+            jobs.append({
+                "path": path,
+                "output_path": outputs[path],
+                "target_lufs": target_lufs,
+                "mode": mode,
+                "analysis": self.analyses.get(path),
+                "tolerance": tolerance,
+                "scratch": self.scratch,
+            })
+
+        self.batch = {"total": len(jobs), "done": 0, "ok": 0, "skipped": 0, "errors": 0, "results": []}
+        self.progress["maximum"] = len(jobs)
         self.progress["value"] = 0
-        ok = 0
-        errores = 0
-
-        for idx, path in enumerate(self.target_paths.copy(), 1):
-            try:
-                filename = os.path.basename(path)
-                self.log(f"\n[{idx}/{total}] {filename}")
-                output_path = os.path.join(self.output_folder, filename)
-
-                try:
-                    target_lufs = float(self.lufs_entry.get())
-                except ValueError:
-                    self.log(self.lang["invalid_lufs"])
-                    target_lufs = -16.0
-
-                # ➤ LUFS y RMS antes
-                original_lufs = analyze_lufs(path)
-                audio = AudioSegment.from_mp3(path)
-                original_rms = round(get_rms(audio), 2)
-
-                self.log("  Normalizando con loudnorm (LUFS)...")
-                self.log(f"  {self.lang['lufs_before']}: {original_lufs} | {self.lang['rms_before']}: {original_rms}")
-                success = normalize_with_ffmpeg_loudnorm(path, output_path, target_lufs)
-                if success:
-                    # ➤ LUFS y RMS después
-                    new_lufs = analyze_lufs(output_path)
-                    audio_new = AudioSegment.from_mp3(output_path)
-                    new_rms = round(get_rms(audio_new), 2)
-
-                    self.log(f"  {self.lang['lufs_after']}: {new_lufs} | {self.lang['rms_after']}: {new_rms}")
-
-                    apply_metadata(path, output_path)
-                    self.log(f"  ✓ Guardado: {output_path}")
-                    ok += 1
-
-                    # ➕ Eliminar del TreeView y lista
-                    if hasattr(self, "tree") and self.tree.winfo_exists():
-                        self.remove_from_treeview(path)
-                    self.target_paths.remove(path)
-                else:
-                    raise Exception("ffmpeg failed")
-
-            except Exception as e:
-                self.log(f"  ✗ Error en {path}: {e}")
-                errores += 1
-
-            self.progress["value"] = idx
-            self.progress.update_idletasks()
+        self.normalize_button.config(state="disabled")
+        self.log(f"\n⚙ {self.lang['workers_label']} {workers}")
+        self.start_task(album_task if self.album_var.get() else normalize_task, jobs, self.analysis_cache, workers)
+
+    def on_normalized(self, result):
+        # Los resultados llegan en orden de finalización, no de la lista
+        batch = self.batch
+        batch["done"] += 1
+        batch["results"].append({"path": result["path"], "timings": result.get("timings", [])})
+        path = result["path"]
+        self.log(f"\n[{batch['done']}/{batch['total']}] {os.path.basename(path)}")
+        if "before" in result:
+            # ➤ LUFS y RMS antes
+            before = result["before"]
+            self.log(f"  {self.lang['lufs_before']}: {round(before['lufs'], 2)} | {self.lang['rms_before']}: {round(before['rms'], 2)} dBFS")
+            album = result.get("album")
+            if album is not None:
+                self.log(f"  {self.lang['album_gain']}: {round(album['lufs'], 2)} LUFS ({album['tracks']}) → {album['gain']:+.2f} dB")
+            if result.get("skipped"):
+                self.log(f"  {self.lang['skipped']} ({result['skipped']})")
+            elif result.get("mode") == "mp3gain" and "steps" in result:
+                self.log(f"  {self.lang['mp3gain_applied']}: {result['steps']:+d} × 1.5 dB ({result['gain']:+.2f} dB)")
+            elif result.get("mode") == "tags" and "gain" in result:
+                self.log(f"  {self.lang['tags_applied']}: {result['gain']:+.2f} dB")
+            elif "linear" in result:
+                mode = self.lang["loudnorm_linear"] if result["linear"] else self.lang["loudnorm_dynamic"]
+                self.log(f"  {mode}: {result['gain']:+.2f} dB")
+
+        if result["ok"]:
+            # ➤ LUFS y RMS después
+            after = result.get("after")
+            if after is not None:
+                self.log(f"  {self.lang['lufs_after']}: {round(after['lufs'], 2)} | {self.lang['rms_after']}: {round(after['rms'], 2)} dBFS")
+            self.log(f"  ✓ Guardado: {result['output_path']}")
+            batch["ok"] += 1
+            if result.get("skipped"):
+                batch["skipped"] += 1
+
+            # ➕ Eliminar del TreeView y lista
+            if hasattr(self, "tree") and self.tree.winfo_exists():
+                self.remove_from_treeview(path)
+            self.target_paths.discard(path)
+            self.analyses.pop(path, None)
+        else:
+            self.log(f"  ✗ Error en {path}: {result.get('error')}")
+            batch["errors"] += 1
+
+        self.progress["value"] = batch["done"]
+
+    def on_normalize_done(self, cancelled):
+        batch = self.batch
+        self.batch = None
+        self.normalize_button.config(state="normal")
+        if cancelled:
+            self.log(f"\n{self.lang['cancelled']}")
 
         self.log(f"\n\n{self.lang['normalization_complete']}")
-        self.log(f"  {self.lang['success_files']}: {ok}")
-        self.log(f"  {self.lang['error_files']}: {errores}")
-        messagebox.showinfo(self.lang['finalized'], f"{self.lang['normalization_complete']}:\n✓ {ok} exitosos\n✗ {errores} errores")
+        self.log(f"  {self.lang['success_files']}: {batch['ok']}")
+        if batch["skipped"]:
+            self.log(f"  {self.lang['skipped_files']}: {batch['skipped']}")
+        self.log(f"  {self.lang['error_files']}: {batch['errors']}")
+        # Dónde se fue el tiempo del lote, por etapa
+        summary = timing.summarize(batch["results"])
+        if summary:
+            self.log("\n" + timing.format_summary(summary))
+        messagebox.showinfo(self.lang['finalized'], f"{self.lang['normalization_complete']}:\n✓ {batch['ok']} exitosos\n✗ {batch['errors']} errores")
 
 
 
 
-if __name__ == "__main__":
+def main():
     root = tk.Tk()
-    app = VolumeNormalizerApp(root)
+    VolumeNormalizerApp(root)
     root.mainloop()
 
+
+if __name__ == "__main__":
+    # Se lanza normalmente con volumatch_gui.py; así también funciona, pero
+    # los procesos del pool importarían tkinter y PIL al arrancar
+    multiprocessing.freeze_support()
+    main()
+
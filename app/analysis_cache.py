@@ -0,0 +1,260 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+# ---------------------- CACHÉ DE ANÁLISIS EN DISCO ----------------------
+#
+# Guarda los resultados de analyze_track en SQLite. La clave principal es
+# (ruta, tamaño, mtime); si no coincide, se busca por un hash del audio que
+# excluye las etiquetas ID3/APE y los metadatos FLAC, así que renombrar un archivo o editar sus
+# etiquetas no invalida la entrada.
+
+DEFAULT_MAX_ENTRIES = 200_000
+EVICT_EVERY = 256
+# Los aciertos actualizan last_used en lotes, cada tantos segundos
+TOUCH_FLUSH_SECONDS = 2.0
+HASH_BLOCK = 1 << 20
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analysis (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    content_hash TEXT,
+    version INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS analysis_hash ON analysis (content_hash);
+CREATE INDEX IF NOT EXISTS analysis_last_used ON analysis (last_used);
+"""
+
+
+def default_cache_path():
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+        return os.path.join(base, "VoluMatch", "analysis.sqlite3")
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "volumatch", "analysis.sqlite3")
+
+
+def id3v2_size(header):
+    # Cabecera ID3v2: "ID3", versión, flags, tamaño syncsafe (+10 si hay footer)
+    if len(header) < 10 or header[:3] != b"ID3":
+        return 0
+    size = 0
+    for byte in header[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    footer = 10 if header[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def trailing_tags_size(f, end):
+    # ID3v1 ("TAG", 128 bytes) y APEv2 ("APETAGEX") al final del archivo
+    trailing = 0
+    if end >= 128:
+        f.seek(end - 128)
+        if f.read(3) == b"TAG":
+            trailing += 128
+    if end - trailing >= 32:
+        f.seek(end - trailing - 32)
+        footer = f.read(32)
+        if footer[:8] == b"APETAGEX":
+            tag_size = int.from_bytes(footer[12:16], "little")
+            has_header = footer[23] & 0x80
+            trailing += tag_size + (32 if has_header else 0)
+    return trailing
+
+
+def flac_metadata_end(f, start):
+    # Bloques de metadatos FLAC (comentarios, imágenes...) antes del audio
+    f.seek(start)
+    if f.read(4) != b"fLaC":
+        return start
+    pos = start + 4
+    while True:
+        header = f.read(4)
+        if len(header) < 4:
+            return pos
+        pos += 4 + int.from_bytes(header[1:4], "big")
+        if header[0] & 0x80:
+            return pos
+        f.seek(pos)
+
+
+def audio_content_hash(path):
+    # En Ogg y MP4 las etiquetas van mezcladas con el audio: ahí el hash
+    # cubre el archivo entero
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        start = flac_metadata_end(f, id3v2_size(f.read(10)))
+        end = size - trailing_tags_size(f, size)
+        f.seek(start)
+        remaining = max(0, end - start)
+        while remaining:
+            block = f.read(min(HASH_BLOCK, remaining))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+    return digest.hexdigest()
+
+
+class AnalysisCache:
+    def __init__(self, db_path=None, analyzer_version=1, max_entries=DEFAULT_MAX_ENTRIES, hash_content=True):
+        self.db_path = db_path or default_cache_path()
+        self.analyzer_version = analyzer_version
+        self.max_entries = max_entries
+        self.hash_content = hash_content
+        self._hashes = {}
+        self._puts = 0
+        self._touched = {}
+        self._touch_flushed = time.monotonic()
+        # Los hilos de segundo plano de la interfaz comparten la conexión
+        self._lock = threading.RLock()
+
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def worker_options(self):
+        # Lo necesario para abrir la misma caché en un proceso del pool
+        return {
+            "db_path": self.db_path,
+            "analyzer_version": self.analyzer_version,
+            "max_entries": self.max_entries,
+            "hash_content": self.hash_content,
+        }
+
+    def lookup(self, path):
+        # Solo la búsqueda barata por (ruta, tamaño, mtime), sin leer el audio:
+        # la usa el hilo que reparte el trabajo
+        try:
+            st = os.stat(path)
+            return self._lookup(path, st)
+        except (OSError, sqlite3.Error, ValueError) as e:
+            print(f"Error reading analysis cache: {e}", file=sys.stderr)
+            return None
+
+    def _lookup(self, path, st):
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT data FROM analysis WHERE path = ? AND size = ? AND mtime_ns = ? AND version = ?",
+                (path, st.st_size, st.st_mtime_ns, self.analyzer_version),
+            ).fetchone()
+            if row:
+                self._touch(path)
+                return json.loads(row[0])
+        return None
+
+    def get(self, path):
+        # Con respaldo por hash del audio, que lee el archivo entero: en los
+        # lotes se hace en los procesos del pool. El hash se calcula fuera
+        # del cerrojo.
+        try:
+            st = os.stat(path)
+            cached = self._lookup(path, st)
+            if cached is not None or not self.hash_content:
+                return cached
+            content_hash = audio_content_hash(path)
+            with self._lock:
+                self._hashes[path] = content_hash
+                row = self.conn.execute(
+                    "SELECT path, data FROM analysis WHERE content_hash = ? AND version = ? "
+                    "ORDER BY last_used DESC LIMIT 1",
+                    (content_hash, self.analyzer_version),
+                ).fetchone()
+                if not row:
+                    return None
+
+                # Mismo audio con otra ruta o etiquetas: se reasigna la entrada
+                old_path, data = row
+                if old_path != path and not os.path.exists(old_path):
+                    self.conn.execute("DELETE FROM analysis WHERE path = ?", (old_path,))
+                self._store(path, st, content_hash, data)
+                return json.loads(data)
+        except (OSError, sqlite3.Error, ValueError) as e:
+            print(f"Error reading analysis cache: {e}", file=sys.stderr)
+            return None
+
+    def put(self, path, analysis):
+        try:
+            st = os.stat(path)
+            with self._lock:
+                content_hash = self._hashes.pop(path, None)
+            if content_hash is None and self.hash_content:
+                content_hash = audio_content_hash(path)
+            with self._lock:
+                self._store(path, st, content_hash, json.dumps(analysis))
+                self._puts += 1
+                if self._puts % EVICT_EVERY == 0:
+                    self.evict()
+        except (OSError, sqlite3.Error) as e:
+            print(f"Error writing analysis cache: {e}", file=sys.stderr)
+
+    def _store(self, path, st, content_hash, data):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO analysis (path, size, mtime_ns, content_hash, version, data, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (path, st.st_size, st.st_mtime_ns, content_hash, self.analyzer_version, data, time.time()),
+            )
+
+    def _touch(self, path):
+        # last_used se acumula en memoria y se escribe en una transacción
+        # corta y confirmada: una lectura nunca deja abierta una transacción
+        # de escritura que bloquee a otros procesos con la misma caché
+        self._touched[path] = time.time()
+        if time.monotonic() - self._touch_flushed >= TOUCH_FLUSH_SECONDS:
+            self._flush_touches()
+
+    def _flush_touches(self):
+        self._touch_flushed = time.monotonic()
+        if not self._touched:
+            return
+        touched, self._touched = self._touched, {}
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE analysis SET last_used = ? WHERE path = ?",
+                [(last_used, path) for path, last_used in touched.items()],
+            )
+
+    def evict(self):
+        # LRU: se conservan las max_entries usadas más recientemente y se
+        # descartan las de otras versiones del analizador
+        with self._lock:
+            self._flush_touches()
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM analysis WHERE version != ?", (self.analyzer_version,))
+            self.conn.execute(
+                "DELETE FROM analysis WHERE path IN "
+                "(SELECT path FROM analysis ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def close(self):
+        try:
+            self.evict()
+            with self._lock:
+                self.conn.close()
+        except sqlite3.Error as e:
+            print(f"Error closing analysis cache: {e}", file=sys.stderr)
+
+
+# Una conexión por proceso del pool, reutilizada entre trabajos
+_process_caches = {}
+
+
+def process_cache(options):
+    key = tuple(sorted(options.items()))
+    cache = _process_caches.get(key)
+    if cache is None:
+        cache = _process_caches[key] = AnalysisCache(**options)
+    return cache
@@ -28,10 +28,21 @@ C:\Users\Cristian\AppData\Local\Programs\Python\Python311\Scripts\pyinstaller.ex
     --add-data "ffmpeg.exe;." ^
     --add-data "..\assets\VoluMatch.png;assets" ^
     --add-data "lang.json;." ^
-    VolumeNormalizerApp.py
+    volumatch_gui.py
+
+REM Línea de comandos sin interfaz (volumatch.exe)
+C:\Users\Cristian\AppData\Local\Programs\Python\Python311\Scripts\pyinstaller.exe ^
+    --noconfirm ^
+    --onefile ^
+    --console ^
+    --name "volumatch" ^
+    --icon "..\assets\VoluMatch.ico" ^
+    --add-data "ffmpeg.exe;." ^
+    volumatch.py
 
 echo ============================
 echo ✅ VoluMatch compilado correctamente
 echo ➜  EXE creado: dist\VoluMatch.exe
+echo ➜  CLI creada: dist\volumatch.exe
 echo ============================
 pause
@@ -0,0 +1,85 @@
+import logging
+import logging.handlers
+import os
+import tkinter as tk
+
+# ---------------------- CONSOLA CON BÚFER ----------------------
+#
+# Los mensajes se acumulan en memoria y se vuelcan al ScrolledText como mucho
+# una vez cada FLUSH_MS, con una sola inserción. El widget conserva solo las
+# últimas MAX_LINES líneas; opcionalmente todo se copia también a un archivo
+# de registro rotativo.
+
+FLUSH_MS = 100
+MAX_LINES = 5000
+LOG_FILE_BYTES = 5 * 1024 * 1024
+LOG_FILE_BACKUPS = 3
+
+
+class ConsoleLog:
+    def __init__(self, root, widget, max_lines=MAX_LINES, flush_ms=FLUSH_MS, log_path=None):
+        self.root = root
+        self.widget = widget
+        self.max_lines = max_lines
+        self.flush_ms = flush_ms
+        self.pending = []
+        # Líneas en el widget, contadas aquí para no preguntar a Tk
+        self.lines = 0
+        self.scheduled = False
+
+        self.file_logger = None
+        if log_path:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+                handler = logging.handlers.RotatingFileHandler(
+                    log_path, maxBytes=LOG_FILE_BYTES, backupCount=LOG_FILE_BACKUPS, encoding="utf-8"
+                )
+                handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+                self.file_logger = logging.getLogger("volumatch.console")
+                self.file_logger.propagate = False
+                self.file_logger.setLevel(logging.INFO)
+                self.file_logger.addHandler(handler)
+            except OSError as e:
+                print(f"Could not open log file: {e}")
+
+    def write(self, message):
+        self.pending.append(message)
+        if not self.scheduled:
+            self.scheduled = True
+            self.root.after(self.flush_ms, self.flush)
+
+    def flush(self):
+        self.scheduled = False
+        if not self.pending:
+            return
+        messages, self.pending = self.pending, []
+        if self.file_logger is not None:
+            for message in messages:
+                self.file_logger.info(message)
+
+        text = "\n".join(messages) + "\n"
+        count = text.count("\n")
+        if count > self.max_lines:
+            # Lo que se borraría enseguida ni siquiera se inserta
+            text = "\n".join(text.split("\n")[-self.max_lines - 1:])
+            count = self.max_lines
+        if not self.widget.winfo_exists():
+            return
+
+        self.widget.configure(state="normal")
+        self.widget.insert(tk.END, text)
+        self.lines += count
+        if self.lines > self.max_lines:
+            # Las líneas más antiguas salen en un solo borrado
+            excess = self.lines - self.max_lines
+            self.widget.delete("1.0", f"{excess + 1}.0")
+            self.lines = self.max_lines
+        self.widget.see(tk.END)
+        self.widget.configure(state="disabled")
+
+    def close(self):
+        self.flush()
+        if self.file_logger is not None:
+            for handler in list(self.file_logger.handlers):
+                handler.close()
+                self.file_logger.removeHandler(handler)
@@ -0,0 +1,892 @@
+import hashlib
+import math
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import mutagen
+import numpy as np
+from mutagen.id3 import ID3, ID3NoHeaderError, TXXX
+from mutagen.mp4 import MP4FreeForm
+from mutagen.oggopus import OggOpus
+
+from analysis_cache import id3v2_size, process_cache
+from loudness import (
+    LoudnessMeter, merged_loudness, pack_blocks, pack_series, seconds_above, sparkline,
+    unpack_blocks, unpack_series,
+)
+from pcm_scratch import PcmScratch, feed_pcm
+from pcm_stream import FfmpegProcess, PcmStream
+from mp3gain import (
+    GAIN_STEP_DB, STALE_GAIN_TAGS, Mp3GainError, apply_mp3_gain, gain_steps, is_stale_gain_frame,
+)
+from output_staging import cleanup_orphans, link_or_copy, staged_output
+from timing import StageTimer
+
+# Núcleo sin interfaz: análisis, normalización, metadatos y motor de trabajos.
+# Lo usan la app Tk y la línea de comandos (volumatch.py); no importa tkinter
+# ni PIL, así los procesos del pool arrancan más rápido.
+
+# ---------------------- FUNCIONES DE AUDIO ----------------------
+
+RMS_BLOCK_FRAMES = 1 << 16
+
+def sum_squares(samples):
+    # Suma de cuadrados por canal de una matriz (frames, canales) de cualquier
+    # tipo, acumulada en float64 por bloques: nunca se crea una copia del
+    # largo total
+    total = np.zeros(samples.shape[1])
+    for start in range(0, len(samples), RMS_BLOCK_FRAMES):
+        block = samples[start:start + RMS_BLOCK_FRAMES]
+        total += np.einsum("ij,ij->j", block, block, dtype=np.float64)
+    return total
+
+def rms_levels(squares, frames, full_scale=1.0):
+    # RMS combinado y por canal en dBFS (una senoidal a fondo de escala da -3 dBFS)
+    def to_db(mean_square):
+        if mean_square <= 0:
+            return float("-inf")
+        return 10 * math.log10(mean_square / (full_scale * full_scale))
+
+    if not frames:
+        return float("-inf"), [float("-inf")] * len(squares)
+    combined = to_db(squares.sum() / (frames * len(squares)))
+    return combined, [to_db(value / frames) for value in squares]
+
+def get_rms(audio):
+    # Lee el PCM de un AudioSegment sin copiarlo (np.frombuffer sobre raw_data)
+    dtype = {1: np.int8, 2: np.int16, 4: np.int32}[audio.sample_width]
+    samples = np.frombuffer(audio.raw_data, dtype=dtype).reshape(-1, audio.channels)
+    full_scale = float(1 << (8 * audio.sample_width - 1))
+    return rms_levels(sum_squares(samples), len(samples), full_scale)
+
+class RmsMeter:
+    # RMS acumulado bloque a bloque sobre PCM float
+    def __init__(self, channels):
+        self.squares = np.zeros(channels)
+        self.frames = 0
+
+    def add_frames(self, frames):
+        self.squares += sum_squares(frames)
+        self.frames += len(frames)
+
+    def result(self):
+        return rms_levels(self.squares, self.frames)
+
+# Subir al cambiar el contenido de los registros de analyze_track
+ANALYZER_VERSION = 6
+
+# Perfil de sonoridad del tema: bloques de energía (modo álbum), series
+# momentánea y de corto plazo e histograma de picos (planificación para
+# cualquier objetivo). Se guarda en la caché, pero no viaja a la interfaz ni
+# a los informes: allí basta la curva en texto.
+PROFILE_KEYS = ("blocks", "momentary", "short_term", "peak_hist")
+
+def strip_profile(analysis):
+    if analysis is None:
+        return None
+    stripped = {key: value for key, value in analysis.items() if key not in PROFILE_KEYS}
+    if "short_term" in analysis:
+        stripped["sparkline"] = sparkline(unpack_series(analysis["short_term"]))
+    return stripped
+
+def analyze_track(path, pcm=None):
+    # Una sola decodificación por archivo, leída por bloques: duración, RMS,
+    # LUFS, LRA y picos con memoria acotada sea cual sea la duración. Con pcm
+    # (caché PCM en disco) se lee el audio ya decodificado.
+    stream = pcm if pcm is not None else PcmStream(path)
+    loudness_meter = LoudnessMeter(stream.sample_rate, stream.channels)
+    rms_meter = RmsMeter(stream.channels)
+    for chunk in stream:
+        loudness_meter.add_frames(chunk)
+        rms_meter.add_frames(chunk)
+
+    loudness = loudness_meter.result()
+    rms, rms_channels = rms_meter.result()
+    return {
+        "duration": loudness["duration"],
+        "rms": rms,
+        "rms_channels": rms_channels,
+        "lufs": loudness["integrated"],
+        "lra": loudness["lra"],
+        "thresh": loudness["threshold"],
+        "sample_peak": loudness["sample_peak"],
+        "true_peak": loudness["true_peak"],
+        "blocks": pack_blocks(loudness["blocks"]),
+        "momentary": pack_series(loudness["momentary"]),
+        "short_term": pack_series(loudness["short_term"]),
+        "peak_hist": loudness["peak_hist"],
+    }
+
+def loudness_measured(analysis):
+    # Silencio o menos de 400 ms de audio: sonoridad -inf (ver
+    # LoudnessMeter.result), no hay ganancia que calcular
+    return math.isfinite(analysis["lufs"])
+
+UNMEASURED_ERROR = "loudness cannot be measured (silent or shorter than 400 ms)"
+
+def analyze_track_cached(path, cache=None):
+    if cache is not None:
+        cached = cache.get(path)
+        if cached is not None:
+            return cached
+    analysis = analyze_track(path)
+    if cache is not None:
+        cache.put(path, analysis)
+    return analysis
+
+
+# ---------------------- METADATOS ----------------------
+
+# STALE_GAIN_TAGS (mp3gain.py) son las etiquetas de volumen del original que
+# no deben pasar a la salida; el modo mp3gain las quita con la misma lista
+# Relleno del ID3 de salida: las ediciones posteriores de etiquetas caben sin
+# reescribir el MP3 entero
+ID3_PADDING = 4096
+
+def metadata_args(input_path, source=0):
+    # ffmpeg copia etiquetas y carátulas (streams attached_pic) durante la
+    # codificación. En .mp4 el stream de vídeo puede ser vídeo de verdad, que
+    # el muxer MP3 no acepta. source es la entrada del archivo original (1 si
+    # el audio llega ya decodificado por la entrada 0).
+    args = ["-map", "0:a:0"]
+    if not input_path.lower().endswith(".mp4"):
+        args += ["-map", f"{source}:v?", "-c:v", "copy"]
+    args += ["-map_metadata", str(source)]
+    for key in STALE_GAIN_TAGS:
+        args += ["-metadata", f"{key}="]
+    return args + ["-id3v2_version", "3", "-metadata_header_padding", str(ID3_PADDING)]
+
+def apply_metadata(src_path, dst_path):
+    # Completa las etiquetas que ffmpeg ya escribió: solo añade los frames ID3
+    # que no sabe copiar (COMM, USLT, POPM...) y quita los TXXX con que los
+    # sustituyó. Cabe en el relleno, así que mutagen guarda en sitio.
+    # Devuelve True si hubo que guardar.
+    try:
+        src_tags = ID3(src_path)
+    except ID3NoHeaderError:
+        return False
+    except Exception as e:
+        print(f"Error copying metadata: {e}", file=sys.stderr)
+        return False
+    try:
+        try:
+            dst_tags = ID3(dst_path)
+        except ID3NoHeaderError:
+            dst_tags = ID3()
+        changed = False
+        for key, frame in list(dst_tags.items()):
+            if key.startswith("TXXX:") and key not in src_tags:
+                del dst_tags[key]
+                changed = True
+        for key, frame in src_tags.items():
+            if key not in dst_tags and not is_stale_gain_frame(frame):
+                dst_tags.add(frame)
+                changed = True
+        if changed:
+            dst_tags.save(dst_path, v2_version=3)
+        return changed
+    except Exception as e:
+        print(f"Error copying metadata: {e}", file=sys.stderr)
+        return False
+
+AUDIO_EXTENSIONS = (".mp3", ".flac", ".ogg", ".oga", ".opus", ".m4a", ".mp4")
+R128_REFERENCE = -23.0
+
+def linear_peak(true_peak):
+    return 10 ** (true_peak / 20) if math.isfinite(true_peak) else 0.0
+
+def write_gain_tags(path, analysis, target_lufs, album=None):
+    # Modo solo etiquetas: ReplayGain (FLAC/OGG/M4A/MP3) o R128 (Opus) en el
+    # propio archivo, sin recodificar. La ganancia lleva el tema al objetivo;
+    # con album (ver album_task) se escriben también los valores de álbum.
+    # Sin sonoridad medible no se escribe nada en el original.
+    if not loudness_measured(analysis):
+        raise Exception(UNMEASURED_ERROR)
+    gain = target_lufs - analysis["lufs"]
+    values = {
+        "REPLAYGAIN_TRACK_GAIN": f"{gain:+.2f} dB",
+        "REPLAYGAIN_TRACK_PEAK": f"{linear_peak(analysis['true_peak']):.6f}",
+        "REPLAYGAIN_REFERENCE_LOUDNESS": f"{target_lufs:.2f} LUFS",
+    }
+    if album is not None:
+        values["REPLAYGAIN_ALBUM_GAIN"] = f"{target_lufs - album['lufs']:+.2f} dB"
+        values["REPLAYGAIN_ALBUM_PEAK"] = f"{linear_peak(album['true_peak']):.6f}"
+
+    audio = mutagen.File(path)
+    if audio is None:
+        raise Exception("unsupported file format")
+    if isinstance(audio, OggOpus):
+        # RFC 7845: entero Q7.8 relativo a -23 LUFS
+        def q78(lufs):
+            return min(32767, max(-32768, int(round((R128_REFERENCE - lufs) * 256))))
+
+        audio["R128_TRACK_GAIN"] = str(q78(analysis["lufs"]))
+        gain = q78(analysis["lufs"]) / 256
+        if album is not None:
+            audio["R128_ALBUM_GAIN"] = str(q78(album["lufs"]))
+    elif path.lower().endswith(".mp3"):
+        try:
+            tags = ID3(path)
+        except ID3NoHeaderError:
+            tags = ID3()
+        # Los valores anteriores, también con otra capitalización
+        # ("replaygain_track_gain"), se quitan para no dejar dos ganancias.
+        # MP3GAIN_* se conserva: describe cambios ya hechos en el audio.
+        for frame in tags.getall("TXXX"):
+            if is_stale_gain_frame(frame) and not frame.desc.upper().startswith("MP3GAIN_"):
+                del tags[frame.HashKey]
+        for key, value in values.items():
+            tags.add(TXXX(encoding=3, desc=key, text=[value]))
+        tags.save(path, v2_version=3)
+        return gain
+    elif path.lower().endswith((".m4a", ".mp4")):
+        if audio.tags is None:
+            audio.add_tags()
+        for key, value in values.items():
+            audio.tags[f"----:com.apple.iTunes:{key.lower()}"] = [MP4FreeForm(value.encode("utf-8"))]
+    else:
+        # Comentarios Vorbis (FLAC, Ogg Vorbis, Ogg FLAC)
+        if audio.tags is None:
+            audio.add_tags()
+        for key, value in values.items():
+            audio[key] = value
+    audio.save()
+    return gain
+
+# ---------------------- ARCHIVOS DE ENTRADA ----------------------
+
+def path_key(path):
+    # Misma clave para "C:/Música/a.mp3" y "c:\música\A.MP3" en Windows
+    return os.path.normcase(os.path.abspath(path))
+
+def iter_audio_files(folder, extensions=AUDIO_EXTENSIONS):
+    # Recorrido recursivo con os.scandir (el tipo de entrada viene del propio
+    # listado, sin un stat por archivo) en orden alfabético. Se siguen los
+    # enlaces a carpetas, pero cada carpeta se visita una sola vez según su
+    # (st_dev, st_ino): un enlace que apunta a un antecesor no crea un bucle.
+    visited = set()
+    stack = [folder]
+    while stack:
+        current = stack.pop()
+        try:
+            st = os.stat(current)
+            if (st.st_dev, st.st_ino) in visited:
+                continue
+            visited.add((st.st_dev, st.st_ino))
+            with os.scandir(current) as listing:
+                entries = sorted(listing, key=lambda entry: entry.name.lower())
+        except OSError as e:
+            print(f"Error reading folder {current}: {e}", file=sys.stderr)
+            continue
+        subfolders = []
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    subfolders.append(entry.path)
+                elif entry.name.lower().endswith(extensions) and entry.is_file():
+                    yield entry.path
+            except OSError:
+                continue
+        # Pila: se invierte para recorrer las subcarpetas en orden
+        stack.extend(reversed(subfolders))
+
+class TargetSet:
+    # Lista de archivos a procesar: conserva el orden de llegada, descarta
+    # duplicados por ruta normalizada y añade/quita/busca en O(1)
+    def __init__(self, paths=()):
+        self._paths = {}
+        self.extend(paths)
+
+    def add(self, path):
+        # Devuelve True si la ruta es nueva
+        key = path_key(path)
+        if key in self._paths:
+            return False
+        self._paths[key] = path
+        return True
+
+    def extend(self, paths):
+        # Devuelve las rutas realmente añadidas, en orden
+        return [path for path in paths if self.add(path)]
+
+    def discard(self, path):
+        self._paths.pop(path_key(path), None)
+
+    def clear(self):
+        self._paths.clear()
+
+    def __contains__(self, path):
+        return path_key(path) in self._paths
+
+    def __iter__(self):
+        return iter(list(self._paths.values()))
+
+    def __len__(self):
+        return len(self._paths)
+
+# ---------------------- NORMALIZACIÓN ----------------------
+
+TARGET_TP = -1.5
+TARGET_LRA = 11
+# Objetivos que acepta loudnorm (parámetro I)
+MIN_TARGET_LUFS = -70.0
+MAX_TARGET_LUFS = -5.0
+
+def loudnorm_measurements(analysis, target_lufs):
+    # Valores de la primera pasada en el formato que espera loudnorm, dentro
+    # de los rangos que acepta el filtro (el silencio da -inf). loudnorm solo
+    # usa el modo lineal con LRA medido distinto de 0, así que se redondea
+    # hacia arriba a su resolución.
+    def clamp(value, low, high):
+        return min(high, max(low, value))
+
+    measured_i = clamp(analysis["lufs"], -99.0, 0.0)
+    return {
+        "measured_I": measured_i,
+        "measured_TP": clamp(analysis["true_peak"], -99.0, 99.0),
+        "measured_LRA": clamp(analysis["lra"], 0.01, 99.0),
+        "measured_thresh": clamp(analysis["thresh"], -99.0, 0.0),
+        "target_offset": target_lufs - measured_i,
+    }
+
+def loudnorm_filter(target_lufs, analysis=None):
+    if analysis is None:
+        return f"loudnorm=I={target_lufs}:TP={TARGET_TP}:LRA={TARGET_LRA}"
+
+    # Segunda pasada lineal: ganancia estática (target_offset) con las medidas
+    # previas. El LRA objetivo nunca baja del medido para que loudnorm no
+    # comprima la dinámica. El parámetro offset de loudnorm solo corrige la
+    # salida del modo dinámico, así que se deja en 0: el modo lineal calcula
+    # su ganancia a partir de measured_I.
+    m = loudnorm_measurements(analysis, target_lufs)
+    lra = min(50.0, max(TARGET_LRA, math.ceil(m["measured_LRA"] * 10) / 10))
+    return (
+        f"loudnorm=I={target_lufs}:TP={TARGET_TP}:LRA={lra}"
+        f":measured_I={m['measured_I']:.2f}:measured_TP={m['measured_TP']:.2f}"
+        f":measured_LRA={m['measured_LRA']:.2f}:measured_thresh={m['measured_thresh']:.2f}"
+        f":linear=true"
+    )
+
+def linear_gain_possible(analysis, target_lufs):
+    # loudnorm vuelve al modo dinámico si la ganancia llevaría el pico por
+    # encima de TP o si el LRA supera el máximo del filtro
+    m = loudnorm_measurements(analysis, target_lufs)
+    if m["measured_thresh"] <= -70.0 or m["measured_TP"] >= 99.0:
+        return False
+    return m["measured_TP"] + m["target_offset"] <= TARGET_TP and m["measured_LRA"] <= 50.0
+
+# Medición del flujo ya procesado dentro de la misma ejecución de ffmpeg:
+# ebur128 (I, LRA, true peak) y astats (RMS) escriben un resumen en stderr al
+# terminar, así el "después" no necesita volver a decodificar la salida.
+# Se mide el PCM que entra al codificador (tras el remuestreo).
+ENCODE_METERS = "aresample=44100,ebur128=peak=true:framelog=verbose,astats"
+
+SUMMARY_PATTERNS = {
+    "lufs": re.compile(r"^\s*I:\s*(-?[\d.]+|-inf) LUFS", re.M),
+    "lra": re.compile(r"^\s*LRA:\s*(-?[\d.]+) LU", re.M),
+    "true_peak": re.compile(r"^\s*Peak:\s*(-?[\d.]+|-inf) dBFS", re.M),
+}
+ASTATS_RMS = re.compile(r"\[Parsed_astats_\d+ @ [^\]]+\] RMS level dB: (\S+)")
+
+def parse_encode_stats(stderr):
+    # Devuelve un registro con las mismas claves que analyze_track (las que
+    # ffmpeg puede dar) o None si falta alguna medida
+    summary_at = stderr.rfind("Summary:")
+    if summary_at == -1:
+        return None
+    summary = stderr[summary_at:]
+    stats = {}
+    for key, pattern in SUMMARY_PATTERNS.items():
+        match = pattern.search(summary)
+        if match is None:
+            return None
+        stats[key] = float(match.group(1))
+
+    # astats escribe un bloque por canal y por último el global ("Overall")
+    levels = [float(value) for value in ASTATS_RMS.findall(stderr)]
+    if len(levels) < 2:
+        return None
+    stats["rms"] = levels[-1]
+    stats["rms_channels"] = levels[:-1]
+    stats["source"] = "encode"
+    return stats
+
+def normalize_with_ffmpeg_loudnorm(input_path, output_path, target_lufs=-16.0, analysis=None, timer=None, pcm=None):
+    # Devuelve las medidas de la salida (o {} si ffmpeg no las dio); si la
+    # codificación falla, el error lleva las últimas líneas de ffmpeg. La
+    # salida solo aparece completa, ya etiquetada.
+    # Con pcm el audio entra ya decodificado por stdin y el original solo
+    # aporta etiquetas y carátula.
+    timer = timer or StageTimer()
+    with staged_output(output_path, timer) as tmp_out:
+        if pcm is not None:
+            inputs = [
+                "-f", "f32le", "-ar", str(pcm.sample_rate), "-ac", str(pcm.channels), "-i", "pipe:0",
+                "-i", input_path,
+            ]
+            bytes_read = pcm.nbytes
+        else:
+            inputs = ["-i", input_path]
+            bytes_read = os.path.getsize(input_path)
+        with timer.stage("encode", bytes_read) as record:
+            norm_cmd = [
+                "ffmpeg", "-y", "-hide_banner", "-nostats",
+                *inputs,
+                *metadata_args(input_path, source=1 if pcm is not None else 0),
+                "-af", f"{loudnorm_filter(target_lufs, analysis)},{ENCODE_METERS}",
+                "-ar", "44100",
+                "-ac", "2",
+                "-b:a", "192k",
+                tmp_out
+            ]
+            # El motivo de un fallo suele ocupar las últimas cuatro líneas
+            ffmpeg = FfmpegProcess(
+                norm_cmd, "ffmpeg failed", lines=4,
+                stdin=subprocess.PIPE if pcm is not None else subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+            )
+            with ffmpeg as process:
+                if pcm is not None:
+                    feed_pcm(process, pcm)
+            stderr = ffmpeg.stderr
+            record["bytes_written"] = os.path.getsize(tmp_out)
+        with timer.stage("metadata") as record:
+            if apply_metadata(input_path, tmp_out):
+                # Solo se reescribe la etiqueta ID3, dentro del relleno
+                with open(tmp_out, "rb") as f:
+                    record["bytes_written"] = id3v2_size(f.read(10))
+    return parse_encode_stats(stderr.decode("utf-8", "replace")) or {}
+
+def mp3gain_steps(analysis, target_lufs):
+    # Pasos de 1.5 dB hacia el objetivo, limitados para que el true peak no
+    # supere TP (la ganancia sin pérdida no tiene limitador). Con un álbum se
+    # pasa su sonoridad y su pico: todos los temas reciben los mismos pasos.
+    if not loudness_measured(analysis):
+        return 0
+    steps = gain_steps(target_lufs - analysis["lufs"])
+    if math.isfinite(analysis["true_peak"]):
+        steps = min(steps, math.floor((TARGET_TP - analysis["true_peak"]) / GAIN_STEP_DB))
+    return steps
+
+# ---------------------- PLANIFICACIÓN DEL OBJETIVO ----------------------
+
+def plan_target(analysis, target_lufs, mode="loudnorm"):
+    # Qué haría cada modo con este objetivo, a partir del análisis guardado y
+    # sin decodificar: ganancia, sonoridad y true peak resultantes y, si hay
+    # perfil, cuántos segundos pasarían de TP (trabajo del limitador en
+    # loudnorm, recortes al reproducir con las etiquetas). Sin sonoridad
+    # medible no hay plan: la ganancia queda en None.
+    if not loudness_measured(analysis):
+        return {
+            "gain": None,
+            "lufs": analysis["lufs"],
+            "true_peak": analysis["true_peak"],
+            "clips": False,
+            "over_seconds": None,
+        }
+    if mode == "mp3gain":
+        steps = mp3gain_steps(analysis, target_lufs)
+        gain = steps * GAIN_STEP_DB
+    else:
+        gain = target_lufs - analysis["lufs"]
+    clips = analysis["true_peak"] + gain > TARGET_TP
+    over_seconds = None
+    if "peak_hist" in analysis:
+        # El histograma redondea por exceso; el true peak manda si no hay riesgo
+        over_seconds = seconds_above(analysis["peak_hist"], TARGET_TP - gain) if clips else 0.0
+    plan = {
+        "gain": gain,
+        "lufs": analysis["lufs"] + gain,
+        "true_peak": analysis["true_peak"] + gain,
+        "clips": clips,
+        "over_seconds": over_seconds,
+    }
+    if mode == "mp3gain":
+        plan["steps"] = steps
+    elif mode == "loudnorm":
+        plan["linear"] = linear_gain_possible(analysis, target_lufs)
+    return plan
+
+# ---------------------- MODO ÁLBUM ----------------------
+
+def album_key(path):
+    # Álbum según las etiquetas (artista del álbum + título) o, sin etiqueta
+    # de álbum, la carpeta que contiene el archivo
+    try:
+        audio = mutagen.File(path, easy=True)
+        tags = audio.tags if audio is not None else None
+    except Exception:
+        tags = None
+    if tags:
+        album = (tags.get("album") or [""])[0].strip()
+        if album:
+            # Sin artista del álbum, el mismo título en carpetas distintas son
+            # álbumes distintos (y los recopilatorios no se parten por artista)
+            artist = (tags.get("albumartist") or [""])[0].strip()
+            scope = artist or os.path.dirname(os.path.abspath(path))
+            return f"{scope}\0{album}".casefold()
+    return path_key(os.path.dirname(os.path.abspath(path)))
+
+def album_loudness(analyses):
+    # Sonoridad del álbum a partir de los bloques guardados de cada tema
+    lufs, thresh = merged_loudness(unpack_blocks(analysis["blocks"]) for analysis in analyses)
+    return {
+        "lufs": lufs,
+        "thresh": thresh,
+        "true_peak": max(analysis["true_peak"] for analysis in analyses),
+        "tracks": len(analyses),
+    }
+
+def shifted_analysis(analysis, gain_db):
+    # La ganancia sin pérdida es exacta: el "después" se calcula sin
+    # decodificar (el perfil y su curva no se desplazan: se quitan)
+    after = {key: value for key, value in analysis.items() if key not in PROFILE_KEYS + ("sparkline",)}
+    for key in ("rms", "lufs", "thresh", "sample_peak", "true_peak"):
+        after[key] = analysis[key] + gain_db
+    after["rms_channels"] = [value + gain_db for value in analysis["rms_channels"]]
+    after["source"] = "predicted"
+    return after
+
+# ---------------------- TRABAJO POR ARCHIVO ----------------------
+
+MODES = ("loudnorm", "mp3gain", "tags")
+
+def default_workers():
+    return os.cpu_count() or 1
+
+def output_path_for(path, mode, output_folder):
+    if mode == "tags":
+        # El modo de etiquetas escribe en los archivos originales
+        return path
+    filename = os.path.basename(path)
+    if mode == "loudnorm":
+        # La recodificación siempre produce MP3
+        filename = os.path.splitext(filename)[0] + ".mp3"
+    return os.path.join(output_folder, filename)
+
+def unique_output_path(output, is_taken):
+    # "x.mp3", "x (2).mp3", "x (3).mp3"... la primera que no esté ocupada
+    base, ext = os.path.splitext(output)
+    number = 2
+    while is_taken(output):
+        output = f"{base} ({number}){ext}"
+        number += 1
+    return output
+
+def output_paths_for(paths, mode, output_folder, roots=()):
+    # Rutas de salida de un lote. Lo que viene de una carpeta añadida conserva
+    # su subcarpeta relativa bajo la de salida (como en el modo vigilancia).
+    # Si aun así dos entradas darían la misma salida (mismo nombre en archivos
+    # sueltos, x.flac y x.mp3 con loudnorm), se numeran: nunca se sobrescriben.
+    if mode == "tags":
+        return {path: path for path in paths}
+    roots = sorted(((path_key(root), root) for root in roots), key=lambda item: len(item[0]), reverse=True)
+    outputs = {}
+    taken = set()
+    for path in paths:
+        folder = output_folder
+        key = path_key(path)
+        for root_key, root in roots:
+            if key.startswith(root_key + os.sep):
+                relative = os.path.relpath(os.path.dirname(os.path.abspath(path)), os.path.abspath(root))
+                folder = os.path.normpath(os.path.join(output_folder, relative))
+                break
+        output = unique_output_path(output_path_for(path, mode, folder), lambda output: path_key(output) in taken)
+        taken.add(path_key(output))
+        outputs[path] = output
+    return outputs
+
+def track_target(job, analysis):
+    # Objetivo efectivo del tema. En modo álbum todos los temas reciben la
+    # misma ganancia (objetivo - sonoridad del álbum), así que cada uno apunta
+    # a su propia sonoridad más esa ganancia; se mantiene dentro del rango
+    # que acepta loudnorm.
+    album = job.get("album")
+    if album is None:
+        return job["target_lufs"]
+    return min(MAX_TARGET_LUFS, max(MIN_TARGET_LUFS, analysis["lufs"] + job["target_lufs"] - album["lufs"]))
+
+def within_tolerance(job, analysis):
+    # Temas que ya están a menos de "tolerance" LU del objetivo no se
+    # procesan: se enlazan o copian tal cual. Solo si la salida conserva el
+    # formato (loudnorm siempre produce MP3) y no se escribe sobre el original.
+    tolerance = job.get("tolerance", 0.0)
+    if tolerance <= 0 or job.get("mode", "loudnorm") == "tags":
+        return False
+    path, output_path = job["path"], job["output_path"]
+    if os.path.splitext(path)[1].lower() != os.path.splitext(output_path)[1].lower():
+        return False
+    if os.path.abspath(path) == os.path.abspath(output_path):
+        return False
+    return abs(track_target(job, analysis) - analysis["lufs"]) <= tolerance
+
+def should_verify(path, fraction):
+    # Muestreo determinista por ruta: la misma fracción de archivos se vuelve
+    # a decodificar en cada ejecución, sin depender del orden del lote
+    if fraction <= 0:
+        return False
+    if fraction >= 1:
+        return True
+    digest = hashlib.blake2b(os.path.normcase(path).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2 ** 64 < fraction
+
+def normalize_track(job):
+    # Se ejecuta en un proceso del pool: analizar, codificar y etiquetar un
+    # archivo. Las medidas "después" salen de la propia codificación; solo la
+    # fracción verify_fraction de los archivos se vuelve a decodificar.
+    # Devuelve un registro serializable con el resultado y los tiempos de
+    # cada etapa.
+    path = job["path"]
+    output_path = job["output_path"]
+    result = {"path": path, "output_path": output_path, "ok": False, "analyzed": False}
+    timer = StageTimer()
+    result["timings"] = timer.records
+    result["mode"] = job.get("mode", "loudnorm")
+    scratch = None
+    pcm = None
+    try:
+        size = os.path.getsize(path)
+        if output_path != path:
+            # Subcarpeta reflejada de la entrada
+            os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        analysis = job.get("analysis")
+        cache = process_cache(job["cache"]) if job.get("cache") is not None else None
+        if analysis is None and cache is not None:
+            # Búsqueda por hash del audio (archivo renombrado o con otras
+            # etiquetas): lee el archivo entero, por eso se hace aquí y no en
+            # el hilo que reparte el trabajo
+            with timer.stage("recall", size):
+                analysis = cache.get(path)
+        if analysis is None:
+            if job.get("scratch") is not None and result["mode"] == "loudnorm":
+                # Analizar y codificar necesitan el audio: se decodifica una
+                # sola vez a la caché PCM y ambos lo leen de ahí
+                scratch = PcmScratch(**job["scratch"])
+                with timer.stage("decode", size) as record:
+                    pcm = scratch.decode(path)
+                    if pcm is not None:
+                        record["bytes_written"] = pcm.nbytes
+            with timer.stage("analyze", pcm.nbytes if pcm is not None else size):
+                analysis = analyze_track(path, pcm)
+            result["analyzed"] = True
+            if cache is not None:
+                cache.put(path, analysis)
+        result["before"] = analysis
+        album = job.get("album")
+        if album is not None:
+            result["album"] = dict(album, gain=job["target_lufs"] - album["lufs"])
+        target = track_target(job, analysis)
+        # mp3gain en modo álbum solo necesita la sonoridad del álbum; el resto
+        # parte de la del propio tema
+        reference = album if album is not None and result["mode"] == "mp3gain" else analysis
+        if not loudness_measured(reference):
+            raise Exception(UNMEASURED_ERROR)
+
+        if within_tolerance(job, analysis):
+            with timer.stage("link") as record:
+                result["skipped"] = link_or_copy(path, output_path)
+                if result["skipped"] == "copy":
+                    record["bytes_read"] = record["bytes_written"] = size
+            result["gain"] = 0.0
+            result["after"] = analysis
+            result["ok"] = True
+            return result
+
+        if result["mode"] == "mp3gain":
+            if not path.lower().endswith(".mp3"):
+                raise Mp3GainError("lossless gain only supports MP3 files")
+            # Con álbum: mismos pasos para todos, limitados por el pico del álbum
+            steps = mp3gain_steps(album or analysis, job["target_lufs"])
+            result["steps"] = steps
+            result["gain"] = steps * GAIN_STEP_DB
+            with timer.stage("mp3gain", size) as record:
+                apply_mp3_gain(path, output_path, steps)
+                record["bytes_written"] = size
+            result["after"] = shifted_analysis(analysis, result["gain"])
+        elif result["mode"] == "tags":
+            with timer.stage("tags"):
+                result["gain"] = write_gain_tags(path, analysis, job["target_lufs"], album)
+        else:
+            result["gain"] = loudnorm_measurements(analysis, target)["target_offset"]
+            result["linear"] = linear_gain_possible(analysis, target)
+            stats = normalize_with_ffmpeg_loudnorm(path, output_path, target, analysis, timer, pcm)
+            if not stats:
+                # ffmpeg sin ebur128/astats: se mide la salida como antes
+                with timer.stage("verify", os.path.getsize(output_path)):
+                    stats = analyze_track(output_path)
+            result["after"] = stats
+        if result["mode"] != "tags" and should_verify(path, job.get("verify_fraction", 0.0)):
+            with timer.stage("verify", os.path.getsize(output_path)):
+                result["verified"] = analyze_track(output_path)
+        result["ok"] = True
+    except Exception as e:
+        result["error"] = str(e)
+    finally:
+        if pcm is not None:
+            scratch.release(pcm)
+    return result
+
+# ---------------------- TAREAS EN SEGUNDO PLANO ----------------------
+
+class BackgroundTask:
+    # Hilo de trabajo que solo se comunica con Tk a través de la cola de
+    # eventos; la interfaz la vacía con root.after
+    def __init__(self, events, work, *args):
+        self.events = events
+        self.cancelled = threading.Event()
+        self.thread = threading.Thread(target=work, args=(self,) + args, daemon=True)
+        self.thread.start()
+
+    def emit(self, *event):
+        self.events.put(event)
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def is_cancelled(self):
+        return self.cancelled.is_set()
+
+def ignore_interrupts():
+    # Ctrl+C llega a todo el grupo de procesos: los trabajadores lo ignoran y
+    # quien los lanzó decide cómo parar
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def iter_pool_results(task, func, items, workers):
+    # Resultados en orden de finalización. Solo hay en vuelo un trabajo por
+    # proceso: al cancelar no empieza ninguno más, y los que están en curso
+    # terminan y se siguen entregando, así nada se escribe sin informarlo.
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=ignore_interrupts)
+    items = iter(items)
+    futures = {}
+    try:
+        while True:
+            while len(futures) < workers and not task.is_cancelled():
+                item = next(items, None)
+                if item is None:
+                    break
+                futures[pool.submit(func, item)] = item
+            if not futures:
+                break
+            done, _ = wait(futures, timeout=0.25, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = futures.pop(future)
+                try:
+                    yield item, future.result(), None
+                except BaseException as e:
+                    yield item, None, e
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def recall_or_analyze(item):
+    # En el proceso del pool: búsqueda por hash del audio en la caché (lee
+    # el archivo entero) y, si no está, el análisis, que se guarda en ella
+    path, cache_options = item
+    cache = process_cache(cache_options) if cache_options is not None else None
+    return analyze_track_cached(path, cache)
+
+def iter_analyses(task, paths, cache, workers):
+    # (ruta, análisis completo, error): primero lo que la caché ya tiene con
+    # la misma ruta, tamaño y mtime (consulta barata en este hilo); el resto
+    # va directo al pool, que hace la búsqueda por hash y el análisis
+    options = cache.worker_options() if cache is not None else None
+    missing = []
+    for path in paths:
+        if task.is_cancelled():
+            break
+        cached = cache.lookup(path) if cache is not None else None
+        if cached is not None:
+            yield path, cached, None
+        else:
+            missing.append((path, options))
+
+    for (path, _), analysis, error in iter_pool_results(task, recall_or_analyze, missing, workers):
+        yield path, analysis, error
+
+def analysis_task(task, paths, cache, workers):
+    for path, analysis, error in iter_analyses(task, paths, cache, workers):
+        if error is not None:
+            task.emit("analysis_error", path, str(error))
+        else:
+            task.emit("analysis", path, strip_profile(analysis))
+    task.emit("analysis_done", task.is_cancelled())
+
+def plan_task(task, paths, cache, workers, target_lufs, mode):
+    # Plan de cada archivo para un objetivo, sin procesar nada. Con la caché
+    # llena, cambiar el objetivo es solo repetir esta consulta.
+    for path, analysis, error in iter_analyses(task, paths, cache, workers):
+        if error is not None:
+            task.emit("planned", {"path": path, "ok": False, "error": str(error)})
+        else:
+            task.emit("planned", {
+                "path": path,
+                "ok": True,
+                "before": strip_profile(analysis),
+                "plan": plan_target(analysis, target_lufs, mode),
+            })
+    task.emit("plan_done", task.is_cancelled())
+
+def folder_scan_task(task, folder):
+    # Recorrer una biblioteca grande no debe congelar la ventana
+    paths = []
+    for path in iter_audio_files(folder):
+        if task.is_cancelled():
+            break
+        paths.append(path)
+    task.emit("folder_scanned", folder, paths)
+
+def normalize_task(task, jobs, cache, workers):
+    # Temporales huérfanos de ejecuciones interrumpidas en las carpetas de salida
+    for folder in {os.path.dirname(job["output_path"]) or "." for job in jobs if job["output_path"] != job["path"]}:
+        if os.path.isdir(folder):
+            cleanup_orphans(folder)
+    if cache is not None:
+        options = cache.worker_options()
+        for job in jobs:
+            if job["analysis"] is None:
+                job["analysis"] = cache.lookup(job["path"])
+            if job["analysis"] is None:
+                # El trabajo busca por hash y guarda su análisis
+                job["cache"] = options
+
+    for job, result, error in iter_pool_results(task, normalize_track, jobs, workers):
+        if error is not None:
+            result = {"path": job["path"], "ok": False, "error": str(error)}
+        for key in ("before", "after"):
+            if key in result:
+                result[key] = strip_profile(result[key])
+        task.emit("normalized", result)
+    task.emit("normalize_done", task.is_cancelled())
+
+def album_task(task, jobs, cache, workers):
+    # Modo álbum en dos fases. Primero se reúnen los análisis con bloques de
+    # todos los temas (caché o análisis en paralelo); después se calcula la
+    # sonoridad de cada álbum con esos bloques, sin volver a decodificar, y
+    # se normaliza con una ganancia común por álbum.
+    by_path = {job["path"]: job for job in jobs}
+    missing = [job["path"] for job in jobs if job["analysis"] is None or "blocks" not in job["analysis"]]
+    failed = set()
+    for path, analysis, error in iter_analyses(task, missing, cache, workers):
+        if error is not None:
+            failed.add(path)
+            task.emit("normalized", {"path": path, "ok": False, "error": str(error)})
+            continue
+        by_path[path]["analysis"] = analysis
+    if task.is_cancelled():
+        task.emit("normalize_done", True)
+        return
+
+    albums = {}
+    for job in jobs:
+        if job["path"] not in failed and job["analysis"] is not None:
+            albums.setdefault(album_key(job["path"]), []).append(job)
+    ready = []
+    for members in albums.values():
+        album = album_loudness([job["analysis"] for job in members])
+        for job in members:
+            job["album"] = album
+            ready.append(job)
+    normalize_task(task, ready, cache, workers)
@@ -0,0 +1,327 @@
+import base64
+import math
+from functools import lru_cache
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# ---------------------- MEDIDOR EBU R128 / BS.1770 ----------------------
+#
+# Implementación vectorizada con NumPy de la medición de sonoridad de
+# ITU-R BS.1770-4 / EBU R128 (integrada, LRA y true peak) sobre PCM ya
+# decodificado, a la frecuencia de muestreo nativa del archivo.
+
+ABSOLUTE_GATE = -70.0
+# Sonoridad integrada cuando ningún bloque pasa las puertas
+UNMEASURED = float("-inf")
+RELATIVE_GATE = -10.0
+LRA_RELATIVE_GATE = -20.0
+
+SUB_BLOCK_SECONDS = 0.1     # paso de 100 ms (solapamiento del 75 %)
+MOMENTARY_SUB_BLOCKS = 4    # bloques de 400 ms
+SHORT_TERM_SUB_BLOCKS = 30  # ventanas de 3 s para LRA
+
+# Perfil guardado con el análisis: sonoridad momentánea cada 400 ms y de
+# corto plazo cada 1 s, y un histograma de los picos de cada bloque de
+# 400 ms en pasos de 0.5 dB desde 0 hasta -40 dBFS
+MOMENTARY_HOP = 4
+SHORT_TERM_HOP = 10
+PEAK_HIST_STEP = 0.5
+PEAK_HIST_BINS = 80
+SPARK_CHARS = " ▁▂▃▄▅▆▇█"
+SPARK_RANGE = (-40.0, -4.0)
+
+# Trozo máximo procesado de una vez, para acotar los temporales
+CHUNK_FRAMES = 1 << 18
+
+
+def _biquad_coefficients(sample_rate):
+    # Coeficientes de la ponderación K para cualquier frecuencia de muestreo
+    # (misma derivación que libebur128)
+    f0 = 1681.974450955533
+    gain = 3.999843853973347
+    q = 0.7071752369554196
+    k = math.tan(math.pi * f0 / sample_rate)
+    vh = 10 ** (gain / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf_b = [(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0]
+    shelf_a = [1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+
+    f0 = 38.13547087602444
+    q = 0.5003270373238773
+    k = math.tan(math.pi * f0 / sample_rate)
+    a0 = 1 + k / q + k * k
+    hp_b = [1.0, -2.0, 1.0]
+    hp_a = [1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    return (shelf_b, shelf_a), (hp_b, hp_a)
+
+
+def _next_pow2(n):
+    return 1 << max(0, int(n - 1).bit_length())
+
+
+@lru_cache(maxsize=None)
+def _k_weighting_spectrum(sample_rate):
+    # La respuesta al impulso de ambos biquads decae por debajo de -200 dB en
+    # 100 ms, así que se filtra como FIR por FFT (overlap-save) sin bucles
+    # muestra a muestra en Python.
+    taps = int(math.ceil(SUB_BLOCK_SECONDS * sample_rate))
+    design = _next_pow2(16 * taps)
+    z = np.exp(-1j * np.pi * np.arange(design // 2 + 1) / (design // 2))
+    response = np.ones_like(z)
+    for b, a in _biquad_coefficients(sample_rate):
+        response *= (b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)
+    impulse = np.fft.irfft(response, design)[:taps]
+
+    fft_size = max(1 << 15, _next_pow2(4 * taps))
+    return taps, fft_size, np.fft.rfft(impulse, fft_size)
+
+
+@lru_cache(maxsize=None)
+def _true_peak_phases(sample_rate):
+    # Filtro polifásico de sobremuestreo (12 coeficientes por fase)
+    if sample_rate < 96000:
+        factor = 4
+    elif sample_rate < 192000:
+        factor = 2
+    else:
+        return None
+    taps = 12
+    n = np.arange(taps * factor) - (taps * factor - 1) / 2
+    prototype = np.sinc(n / factor) * np.kaiser(taps * factor, 8.0)
+    phases = prototype.reshape(taps, factor)
+    phases = phases / phases.sum(axis=0)
+    # Invertido para usarlo como correlación sobre sliding_window_view
+    return np.ascontiguousarray(phases[::-1], dtype=np.float32)
+
+
+def _channel_weights(channels):
+    if channels == 5:
+        return np.array([1.0, 1.0, 1.0, 1.41, 1.41])
+    if channels == 6:
+        # L, R, C, LFE, Ls, Rs: el LFE no cuenta
+        return np.array([1.0, 1.0, 1.0, 0.0, 1.41, 1.41])
+    return np.ones(channels)
+
+
+def _energy_to_lufs(energy):
+    with np.errstate(divide="ignore"):
+        return -0.691 + 10 * np.log10(energy)
+
+
+def _gated_mean(energies, relative_gate):
+    loudness = _energy_to_lufs(energies)
+    above_absolute = energies[loudness > ABSOLUTE_GATE]
+    if not len(above_absolute):
+        return None, ABSOLUTE_GATE
+    threshold = float(_energy_to_lufs(above_absolute.mean())) + relative_gate
+    gated = above_absolute[_energy_to_lufs(above_absolute) > threshold]
+    if not len(gated):
+        return None, threshold
+    return gated, threshold
+
+
+def _to_db(value):
+    if value <= 0:
+        return float("-inf")
+    return 20 * math.log10(value)
+
+
+class LoudnessMeter:
+    def __init__(self, sample_rate, channels):
+        self.sample_rate = int(sample_rate)
+        self.channels = int(channels)
+        self.frames = 0
+
+        self._weights = _channel_weights(self.channels)
+        self._taps, self._fft_size, self._spectrum = _k_weighting_spectrum(self.sample_rate)
+        self._filter_history = np.zeros((self._taps - 1, self.channels))
+
+        self._sub_block = int(round(SUB_BLOCK_SECONDS * self.sample_rate))
+        self._pending = np.zeros((0, self.channels))
+        self._sub_blocks = []
+        self._pending_peaks = np.zeros(0)
+        self._sub_block_peaks = []
+
+        self._phases = _true_peak_phases(self.sample_rate)
+        self._peak_history = np.zeros((11, self.channels))
+        self._sample_peak = 0.0
+        self._true_peak = 0.0
+
+    def add_frames(self, frames):
+        frames = np.asarray(frames, dtype=np.float64)
+        if frames.ndim == 1:
+            frames = frames[:, None]
+        for start in range(0, len(frames), CHUNK_FRAMES):
+            self._add_chunk(frames[start:start + CHUNK_FRAMES])
+
+    def _add_chunk(self, chunk):
+        if not len(chunk):
+            return
+        self.frames += len(chunk)
+        self._measure_peaks(chunk)
+
+        weighted = self._k_weight(chunk)
+        if len(self._pending):
+            weighted = np.concatenate([self._pending, weighted])
+        # Pico de muestra por sub-bloque, con la misma alineación que la energía
+        peaks = np.abs(chunk).max(axis=1)
+        if len(self._pending_peaks):
+            peaks = np.concatenate([self._pending_peaks, peaks])
+        complete = len(weighted) // self._sub_block
+        if complete:
+            end = complete * self._sub_block
+            blocks = weighted[:end].reshape(complete, self._sub_block, self.channels)
+            self._sub_blocks.append(np.einsum("ijk,ijk->ik", blocks, blocks))
+            self._sub_block_peaks.append(peaks[:end].reshape(complete, self._sub_block).max(axis=1))
+        self._pending = weighted[complete * self._sub_block:]
+        self._pending_peaks = peaks[complete * self._sub_block:]
+
+    def _k_weight(self, chunk):
+        buffer = np.concatenate([self._filter_history, chunk])
+        self._filter_history = buffer[len(buffer) - (self._taps - 1):]
+
+        step = self._fft_size - self._taps + 1
+        out = np.empty_like(chunk)
+        for start in range(0, len(chunk), step):
+            segment = buffer[start:start + self._fft_size]
+            spectrum = np.fft.rfft(segment, self._fft_size, axis=0) * self._spectrum[:, None]
+            filtered = np.fft.irfft(spectrum, self._fft_size, axis=0)
+            count = min(step, len(chunk) - start)
+            out[start:start + count] = filtered[self._taps - 1:self._taps - 1 + count]
+        return out
+
+    def _measure_peaks(self, chunk):
+        self._sample_peak = max(self._sample_peak, float(np.abs(chunk).max()))
+        if self._phases is None:
+            self._true_peak = max(self._true_peak, self._sample_peak)
+            return
+        buffer = np.concatenate([self._peak_history, chunk])
+        self._peak_history = buffer[len(buffer) - 11:]
+        for channel in range(self.channels):
+            samples = buffer[:, channel].astype(np.float32)
+            # Copia contigua: el producto matricial sobre la vista con strides
+            # no aprovecha BLAS
+            windows = np.ascontiguousarray(sliding_window_view(samples, 12))
+            upsampled = windows @ self._phases
+            self._true_peak = max(self._true_peak, float(np.abs(upsampled).max()))
+        self._true_peak = max(self._true_peak, self._sample_peak)
+
+    def _weighted_sub_blocks(self):
+        if not self._sub_blocks:
+            return np.zeros(0)
+        return np.concatenate(self._sub_blocks) @ self._weights
+
+    def _windows(self, sub_blocks, size):
+        if len(sub_blocks) < size:
+            return np.zeros(0)
+        sums = np.cumsum(np.concatenate([[0.0], sub_blocks]))
+        return (sums[size:] - sums[:-size]) / (size * self._sub_block)
+
+    def result(self):
+        sub_blocks = self._weighted_sub_blocks()
+
+        momentary = self._windows(sub_blocks, MOMENTARY_SUB_BLOCKS)
+        gated, threshold = _gated_mean(momentary, RELATIVE_GATE)
+        # Bloques de 400 ms por encima de la puerta absoluta: bastan para
+        # calcular la sonoridad de varios temas juntos (álbum) sin decodificar
+        blocks = momentary[_energy_to_lufs(momentary) > ABSOLUTE_GATE].astype(np.float32)
+        # Sin ningún bloque de 400 ms por encima de las puertas (silencio o
+        # menos de 400 ms de audio) la sonoridad no se puede medir: -inf, no
+        # el valor de la puerta, para que nadie calcule una ganancia con él
+        integrated = float(_energy_to_lufs(gated.mean())) if gated is not None else UNMEASURED
+
+        short_term = self._windows(sub_blocks, SHORT_TERM_SUB_BLOCKS)
+        lra_blocks, _ = _gated_mean(short_term, LRA_RELATIVE_GATE)
+        lra = 0.0
+        if lra_blocks is not None:
+            low, high = np.percentile(_energy_to_lufs(lra_blocks), [10, 95])
+            lra = float(high - low)
+
+        # Picos por bloque de 400 ms sin solapar
+        block_peaks = np.zeros(0)
+        if self._sub_block_peaks:
+            sub_block_peaks = np.concatenate(self._sub_block_peaks)
+            count = len(sub_block_peaks) // MOMENTARY_SUB_BLOCKS
+            block_peaks = sub_block_peaks[:count * MOMENTARY_SUB_BLOCKS].reshape(count, MOMENTARY_SUB_BLOCKS).max(axis=1)
+
+        return {
+            "integrated": integrated,
+            "lra": lra,
+            "threshold": threshold,
+            "sample_peak": _to_db(self._sample_peak),
+            "true_peak": _to_db(self._true_peak),
+            "duration": self.frames / self.sample_rate,
+            "blocks": blocks,
+            "momentary": _energy_to_lufs(momentary[::MOMENTARY_HOP]),
+            "short_term": _energy_to_lufs(short_term[::SHORT_TERM_HOP]),
+            "peak_hist": peak_histogram(block_peaks),
+        }
+
+
+def pack_blocks(blocks):
+    # float32 en base64: compacto y serializable en JSON (caché, pool)
+    return base64.b64encode(np.asarray(blocks, dtype="<f4").tobytes()).decode("ascii")
+
+
+def unpack_blocks(text):
+    return np.frombuffer(base64.b64decode(text), dtype="<f4").astype(np.float64)
+
+
+def pack_series(values):
+    # Series de sonoridad en float16: de sobra para curvas y planificación
+    return base64.b64encode(np.asarray(values, dtype="<f2").tobytes()).decode("ascii")
+
+
+def unpack_series(text):
+    return np.frombuffer(base64.b64decode(text), dtype="<f2").astype(np.float64)
+
+
+def peak_histogram(peaks):
+    # Bin i: bloques con pico en (-(i+1)*paso, -i*paso] dBFS; lo que pasa de
+    # 0 dBFS cae en el primero y lo que baja de -40 no se cuenta
+    with np.errstate(divide="ignore"):
+        levels = 20 * np.log10(np.asarray(peaks, dtype=np.float64))
+    index = np.floor(np.maximum(-levels, 0.0) / PEAK_HIST_STEP)
+    index = index[index < PEAK_HIST_BINS].astype(np.int64)
+    return np.bincount(index, minlength=PEAK_HIST_BINS).tolist()
+
+
+def seconds_above(peak_hist, level_db):
+    # Tiempo (en bloques de 400 ms) con pico por encima de level_db. Cuenta
+    # el bin entero que contiene el nivel: estimación por exceso de 0.5 dB.
+    bins = min(len(peak_hist), math.ceil(-level_db / PEAK_HIST_STEP))
+    seconds_per_block = SUB_BLOCK_SECONDS * MOMENTARY_SUB_BLOCKS
+    return sum(peak_hist[:max(0, bins)]) * seconds_per_block
+
+
+def sparkline(values, width=24):
+    # Curva de texto de ancho fijo: máximo de cada tramo, en escala absoluta
+    # para que los temas sean comparables entre sí
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return ""
+    low, high = SPARK_RANGE
+    chars = []
+    for part in np.array_split(values, min(width, len(values))):
+        level = (part.max() - low) / (high - low)
+        if not math.isfinite(level) or level <= 0:
+            chars.append(SPARK_CHARS[0])
+        else:
+            chars.append(SPARK_CHARS[min(len(SPARK_CHARS) - 1, 1 + int(level * (len(SPARK_CHARS) - 2)))])
+    return "".join(chars)
+
+
+def merged_loudness(block_sets):
+    # Sonoridad integrada de varios temas como si fueran uno solo (BS.1770:
+    # las puertas se aplican sobre todos los bloques juntos). Devuelve
+    # (integrada, umbral relativo).
+    blocks = [np.asarray(item, dtype=np.float64) for item in block_sets if len(item)]
+    if not blocks:
+        return UNMEASURED, ABSOLUTE_GATE
+    gated, threshold = _gated_mean(np.concatenate(blocks), RELATIVE_GATE)
+    if gated is None:
+        return UNMEASURED, threshold
+    return float(_energy_to_lufs(gated.mean())), threshold
+
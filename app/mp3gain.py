@@ -0,0 +1,233 @@
+import math
+import mmap
+import os
+import shutil
+
+from mutagen.apev2 import APENoHeaderError, APEv2
+from mutagen.id3 import ID3, ID3NoHeaderError, TXXX
+
+from analysis_cache import id3v2_size, trailing_tags_size
+from output_staging import staged_output
+
+# ---------------------- GANANCIA MP3 SIN PÉRDIDA ----------------------
+#
+# Igual que mp3gain: se desplaza el campo global_gain de cada gránulo en la
+# side info de los frames MP3. Cada paso equivale a 2^(1/4) en amplitud
+# (~1.5 dB). No se decodifica ni recodifica nada; solo se reescriben unos
+# bytes por frame.
+
+GAIN_STEP_DB = 5 * math.log10(2)
+UNDO_FRAME = "MP3GAIN_UNDO"
+
+# Etiquetas que describen el volumen del original: dejan de valer en cuanto
+# cambia la ganancia, así que no deben pasar a la salida (ver también
+# core.metadata_args)
+STALE_GAIN_TAGS = (
+    "REPLAYGAIN_TRACK_GAIN", "REPLAYGAIN_TRACK_PEAK", "REPLAYGAIN_ALBUM_GAIN",
+    "REPLAYGAIN_ALBUM_PEAK", "REPLAYGAIN_REFERENCE_LOUDNESS",
+    "R128_TRACK_GAIN", "R128_ALBUM_GAIN", UNDO_FRAME, "MP3GAIN_MINMAX",
+    "MP3GAIN_ALBUM_MINMAX",
+)
+
+BITRATES = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+SAMPLE_RATES = {
+    3: [44100, 48000, 32000],  # MPEG 1
+    2: [22050, 24000, 16000],  # MPEG 2
+    0: [11025, 12000, 8000],   # MPEG 2.5
+}
+
+
+class Mp3GainError(Exception):
+    pass
+
+
+def gain_steps(gain_db):
+    return int(round(gain_db / GAIN_STEP_DB))
+
+
+def _parse_header(data, pos):
+    # Devuelve (longitud del frame, offset de la side info, posiciones en bits
+    # de global_gain) o None si en pos no empieza un frame Layer III válido
+    if data[pos] != 0xFF or data[pos + 1] & 0xE0 != 0xE0:
+        return None
+    version = (data[pos + 1] >> 3) & 3
+    layer = (data[pos + 1] >> 1) & 3
+    bitrate_index = data[pos + 2] >> 4
+    rate_index = (data[pos + 2] >> 2) & 3
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+
+    mpeg1 = version == 3
+    bitrate = BITRATES[1 if mpeg1 else 2][bitrate_index] * 1000
+    sample_rate = SAMPLE_RATES[version][rate_index]
+    padding = (data[pos + 2] >> 1) & 1
+    length = (144 if mpeg1 else 72) * bitrate // sample_rate + padding
+
+    channels = 1 if data[pos + 3] >> 6 == 3 else 2
+    protected = not (data[pos + 1] & 1)
+    side_info = pos + 4 + (2 if protected else 0)
+    if mpeg1:
+        base = 9 + (5 if channels == 1 else 3) + 4 * channels
+        gains = [base + (gr * channels + ch) * 59 + 21 for gr in range(2) for ch in range(channels)]
+        side_length = 17 if channels == 1 else 32
+    else:
+        base = 8 + (1 if channels == 1 else 2)
+        gains = [base + ch * 63 + 21 for ch in range(channels)]
+        side_length = 9 if channels == 1 else 17
+    return length, side_info, side_length, protected, gains
+
+
+def _get_bits(data, start, bit, count):
+    value = 0
+    for i in range(bit, bit + count):
+        value = (value << 1) | ((data[start + (i >> 3)] >> (7 - (i & 7))) & 1)
+    return value
+
+
+def _set_bits(data, start, bit, count, value):
+    for i in range(bit, bit + count):
+        shift = 7 - (i & 7)
+        mask = 1 << shift
+        byte = data[start + (i >> 3)]
+        if (value >> (bit + count - 1 - i)) & 1:
+            data[start + (i >> 3)] = byte | mask
+        else:
+            data[start + (i >> 3)] = byte & ~mask & 0xFF
+
+
+def _crc16(data, start, end, crc=0xFFFF):
+    for pos in range(start, end):
+        crc ^= data[pos] << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x8005) if crc & 0x8000 else crc << 1
+            crc &= 0xFFFF
+    return crc
+
+
+def _is_info_frame(data, frame, side_info, side_length):
+    # Frame Xing/Info/VBRI de cabecera VBR: no contiene audio
+    tag = side_info + side_length
+    return data[tag:tag + 4] in (b"Xing", b"Info") or data[frame + 36:frame + 40] == b"VBRI"
+
+
+def apply_gain_steps(path, steps):
+    # Modifica el archivo en sitio; devuelve el número de frames tocados
+    if steps == 0:
+        return 0
+    frames = 0
+    with open(path, "r+b") as f:
+        size = os.fstat(f.fileno()).st_size
+        start = id3v2_size(f.read(10))
+        end = size - trailing_tags_size(f, size)
+        with mmap.mmap(f.fileno(), 0) as data:
+            pos = start
+            while pos + 4 <= end:
+                header = _parse_header(data, pos)
+                if header is None or pos + header[0] > end:
+                    # Basura o sincronización perdida: buscar el siguiente frame
+                    pos = data.find(b"\xff", pos + 1, end)
+                    if pos == -1:
+                        break
+                    continue
+                length, side_info, side_length, protected, gains = header
+                if frames == 0 and _is_info_frame(data, pos, side_info, side_length):
+                    pos += length
+                    continue
+
+                for bit in gains:
+                    gain = _get_bits(data, side_info, bit, 8)
+                    _set_bits(data, side_info, bit, 8, min(255, max(0, gain + steps)))
+                if protected:
+                    # El CRC cubre los dos últimos bytes de la cabecera y la side info
+                    crc = _crc16(data, pos + 2, pos + 4)
+                    crc = _crc16(data, side_info, side_info + side_length, crc)
+                    data[pos + 4:pos + 6] = crc.to_bytes(2, "big")
+                frames += 1
+                pos += length
+            data.flush()
+    if not frames:
+        raise Mp3GainError(f"No MPEG Layer III frames found in {path}")
+    return frames
+
+
+def _undo_value(text):
+    # "+003,+003,N": se toma el canal izquierdo, como al escribirlo
+    return int(str(text).split(",")[0])
+
+
+def read_undo_steps(path):
+    # Pasos acumulados: los nuestros van en ID3 y los de mp3gain en APEv2;
+    # si hay de los dos, el audio lleva ambos cambios
+    steps = 0
+    try:
+        frame = ID3(path).get(f"TXXX:{UNDO_FRAME}")
+    except ID3NoHeaderError:
+        frame = None
+    if frame is not None:
+        steps += _undo_value(frame.text[0])
+    try:
+        item = APEv2(path).get(UNDO_FRAME)
+    except APENoHeaderError:
+        item = None
+    if item is not None:
+        steps += _undo_value(item)
+    return steps
+
+
+def is_stale_gain_frame(frame):
+    # Hay programas que escriben las descripciones TXXX en minúsculas
+    return str(getattr(frame, "desc", "")).upper() in STALE_GAIN_TAGS
+
+
+def _strip_ape_gain_tags(path):
+    # mp3gain y otros guardan ReplayGain también en un APEv2 al final. Su
+    # MP3GAIN_UNDO también se quita: write_undo_steps recibe el total, que
+    # ya lo incluye (read_undo_steps)
+    try:
+        tags = APEv2(path)
+    except APENoHeaderError:
+        return
+    stale = [key for key in tags.keys() if key.upper() in STALE_GAIN_TAGS]
+    if not stale:
+        return
+    for key in stale:
+        del tags[key]
+    if len(tags):
+        tags.save(path)
+    else:
+        tags.delete(path)
+
+
+def write_undo_steps(path, steps):
+    # Mismo formato que mp3gain: "+003,+003,N" (izquierda, derecha, sin clip).
+    # Se llama tras cada cambio de ganancia, así que también quita las
+    # etiquetas de volumen que ya no corresponden al audio.
+    try:
+        tags = ID3(path)
+    except ID3NoHeaderError:
+        tags = ID3()
+    for frame in tags.getall("TXXX"):
+        if is_stale_gain_frame(frame):
+            del tags[frame.HashKey]
+    if steps:
+        tags.add(TXXX(encoding=3, desc=UNDO_FRAME, text=[f"{steps:+04d},{steps:+04d},N"]))
+    tags.save(path)
+    _strip_ape_gain_tags(path)
+
+
+def apply_mp3_gain(input_path, output_path, steps):
+    if input_path == output_path:
+        apply_gain_steps(output_path, steps)
+        write_undo_steps(output_path, read_undo_steps(output_path) + steps)
+        return steps
+    # La copia se modifica en un temporal de la carpeta de destino y aparece
+    # de una vez, ya con la etiqueta de deshacer
+    with staged_output(output_path) as tmp_out:
+        shutil.copyfile(input_path, tmp_out)
+        apply_gain_steps(tmp_out, steps)
+        write_undo_steps(tmp_out, read_undo_steps(tmp_out) + steps)
+    return steps
+
@@ -0,0 +1,125 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+# ---------------------- SALIDA ATÓMICA ----------------------
+#
+# Cada salida se escribe en un temporal con nombre único dentro de la propia
+# carpeta de destino y se confirma con os.replace: sin una segunda copia
+# entre volúmenes (NAS, otro disco) y sin archivos a medias si el proceso
+# muere. mkstemp crea el archivo, así que dos procesos nunca comparten nombre.
+
+STAGING_PREFIX = ".volumatch-"
+STAGING_MARK = ".part"
+# Solo se borran los huérfanos antiguos: los recientes pueden ser de otra
+# ejecución que sigue en marcha sobre la misma carpeta
+ORPHAN_MAX_AGE = 6 * 3600
+
+# mkstemp crea los archivos con permisos 0600; la salida final lleva los
+# habituales según la umask del proceso
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def staging_path(output_path):
+    # La extensión final se conserva: ffmpeg elige el formato por ella
+    folder = os.path.dirname(os.path.abspath(output_path))
+    extension = os.path.splitext(output_path)[1]
+    fd, path = tempfile.mkstemp(prefix=STAGING_PREFIX, suffix=STAGING_MARK + extension, dir=folder)
+    os.close(fd)
+    os.chmod(path, 0o666 & ~_UMASK)
+    return path
+
+
+@contextmanager
+def staged_output(output_path, timer=None):
+    # with staged_output(destino) as tmp: escribir en tmp; al salir sin
+    # excepción se renombra sobre el destino, si no se borra
+    path = staging_path(output_path)
+    try:
+        yield path
+        if timer is None:
+            os.replace(path, output_path)
+        else:
+            with timer.stage("commit"):
+                os.replace(path, output_path)
+    except BaseException:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        raise
+
+
+def is_staging_file(name):
+    return name.startswith(STAGING_PREFIX) and STAGING_MARK in name
+
+
+def cleanup_orphans(folder, max_age=ORPHAN_MAX_AGE):
+    # Temporales abandonados por una ejecución interrumpida; devuelve cuántos
+    # se borraron
+    removed = 0
+    limit = time.time() - max_age
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if not is_staging_file(entry.name):
+                    continue
+                try:
+                    if entry.is_file(follow_symlinks=False) and entry.stat(follow_symlinks=False).st_mtime < limit:
+                        os.remove(entry.path)
+                        removed += 1
+                except OSError:
+                    pass
+    except OSError as e:
+        print(f"Error cleaning temporary files: {e}", file=sys.stderr)
+    return removed
+
+
+# ---------------------- ENLACE O COPIA ----------------------
+
+# ioctl FICLONE de Linux (_IOW(0x94, 9, int)): copia por referencia en Btrfs,
+# XFS y similares, sin duplicar los datos en disco
+FICLONE = 0x40049409
+
+
+def _reflink(src_path, dst_path):
+    if not sys.platform.startswith("linux"):
+        return False
+    import fcntl
+    try:
+        with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        shutil.copystat(src_path, dst_path)
+        return True
+    except OSError:
+        return False
+
+
+def link_or_copy(src_path, dst_path):
+    # Deja en dst_path el mismo contenido que src_path por el medio más barato
+    # disponible: enlace duro, copia por referencia o copia normal. Devuelve
+    # el método usado ("hardlink", "reflink" o "copy").
+    path = staging_path(dst_path)
+    try:
+        os.remove(path)
+        try:
+            os.link(src_path, path)
+            method = "hardlink"
+        except OSError:
+            if _reflink(src_path, path):
+                method = "reflink"
+            else:
+                shutil.copy2(src_path, path)
+                method = "copy"
+        os.replace(path, dst_path)
+        return method
+    except BaseException:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        raise
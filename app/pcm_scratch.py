@@ -0,0 +1,153 @@
+import os
+import shutil
+import tempfile
+import time
+
+import mutagen
+import numpy as np
+
+from pcm_stream import CHUNK_FRAMES, PcmStream
+
+# ---------------------- CACHÉ PCM EN DISCO ----------------------
+#
+# Opcional. Cada entrada se decodifica una sola vez a float32 crudo en una
+# carpeta local con un tope de tamaño; el análisis (RMS, sonoridad, picos) y
+# el codificador, alimentado por una tubería, lo leen con numpy.memmap en
+# lugar de volver a decodificar el original. El archivo se borra al terminar
+# el trabajo; los restos de ejecuciones interrumpidas se borran cuando hace
+# falta sitio. Si no cabe en el tope, el trabajo decodifica como siempre.
+
+SCRATCH_PREFIX = "volumatch-"
+SCRATCH_SUFFIX = ".f32"
+DEFAULT_BUDGET_MB = 2048
+STALE_SECONDS = 6 * 3600
+COPY_BYTES = 1 << 20
+
+
+def default_scratch_folder():
+    return os.path.join(tempfile.gettempdir(), "volumatch-pcm")
+
+
+def estimated_bytes(path, sample_rate, channels):
+    # Tamaño del PCM según la duración de la cabecera (None si no se conoce)
+    try:
+        audio = mutagen.File(path)
+        length = audio.info.length if audio is not None and audio.info is not None else 0
+    except Exception:
+        length = 0
+    if not length:
+        return None
+    return int(length * sample_rate + sample_rate) * channels * 4
+
+
+class ScratchPcm:
+    # Se recorre igual que PcmStream, pero por vistas de un memmap
+    def __init__(self, path, sample_rate, channels, chunk_frames=CHUNK_FRAMES):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.chunk_frames = chunk_frames
+        self.samples = np.memmap(path, dtype="<f4", mode="r").reshape(-1, channels)
+        self.nbytes = self.samples.nbytes
+
+    def __iter__(self):
+        for start in range(0, len(self.samples), self.chunk_frames):
+            yield self.samples[start:start + self.chunk_frames]
+
+    def close(self):
+        self.samples = None
+
+
+class PcmScratch:
+    def __init__(self, folder=None, budget_mb=DEFAULT_BUDGET_MB):
+        self.folder = folder or default_scratch_folder()
+        self.budget = int(budget_mb * 1024 * 1024)
+
+    def entries(self):
+        try:
+            with os.scandir(self.folder) as it:
+                return [entry for entry in it
+                        if entry.name.startswith(SCRATCH_PREFIX) and entry.name.endswith(SCRATCH_SUFFIX)]
+        except OSError:
+            return []
+
+    def usage(self):
+        total = 0
+        for entry in self.entries():
+            try:
+                total += entry.stat().st_size
+            except OSError:
+                pass
+        return total
+
+    def evict_stale(self):
+        # Solo restos viejos: los archivos recientes pueden ser de otros
+        # trabajos en curso
+        now = time.time()
+        for entry in self.entries():
+            try:
+                if now - entry.stat().st_mtime > STALE_SECONDS:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+    def decode(self, path):
+        # Devuelve un ScratchPcm, o None si no hay sitio en el tope
+        stream = PcmStream(path)
+        sample_rate, channels = stream.sample_rate, stream.channels
+        estimate = estimated_bytes(path, sample_rate, channels)
+        if estimate is None or estimate > self.budget:
+            return None
+        os.makedirs(self.folder, exist_ok=True)
+        if self.usage() + estimate > self.budget:
+            self.evict_stale()
+            if self.usage() + estimate > self.budget:
+                return None
+
+        # El archivo se reserva con su tamaño estimado para que los demás
+        # procesos lo cuenten mientras se llena. ffmpeg decodifica igual que
+        # PcmStream, a stdout, y aquí se copia sobre la reserva: si abriera el
+        # archivo él mismo lo truncaría y la reserva desaparecería. Al final
+        # se ajusta al tamaño real.
+        fd, scratch_path = tempfile.mkstemp(prefix=SCRATCH_PREFIX, suffix=SCRATCH_SUFFIX, dir=self.folder)
+        os.ftruncate(fd, estimate)
+        if self.usage() > self.budget:
+            # Otro proceso reservó a la vez: se vuelve a comprobar ya con la
+            # reserva propia a la vista y, si no cabe, se cede
+            os.close(fd)
+            self._remove(scratch_path)
+            return None
+        try:
+            with os.fdopen(fd, "r+b") as f:
+                with stream.decoder() as process:
+                    shutil.copyfileobj(process.stdout, f, COPY_BYTES)
+                written = f.tell()
+                f.truncate(written)
+        except BaseException:
+            self._remove(scratch_path)
+            raise
+        if not written:
+            self._remove(scratch_path)
+            return None
+        return ScratchPcm(scratch_path, sample_rate, channels)
+
+    def release(self, pcm):
+        pcm.close()
+        self._remove(pcm.path)
+
+    def _remove(self, scratch_path):
+        try:
+            os.remove(scratch_path)
+        except OSError:
+            # Windows no borra un archivo aún mapeado: queda para evict_stale
+            pass
+
+
+def feed_pcm(process, pcm):
+    # Escribe el PCM en el stdin de un ffmpeg ("-i pipe:0"; ver FfmpegProcess)
+    try:
+        for chunk in pcm:
+            process.stdin.write(chunk)
+    except BrokenPipeError:
+        # ffmpeg terminó antes de tiempo: el código de salida lo explica
+        pass
@@ -0,0 +1,128 @@
+import subprocess
+import sys
+import tempfile
+
+import mutagen
+import numpy as np
+from mutagen.oggopus import OggOpus
+
+# ---------------------- LECTOR PCM POR BLOQUES ----------------------
+#
+# ffmpeg decodifica a float32 intercalado por una tubería y se lee en bloques
+# de tamaño fijo, así que la memoria por archivo no depende de su duración.
+
+CHUNK_FRAMES = 1 << 16
+FALLBACK_SAMPLE_RATE = 48000
+FALLBACK_CHANNELS = 2
+# Sin ventana de consola por cada ffmpeg en Windows
+STARTUP_FLAGS = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+
+
+def probe_stream(path):
+    # Frecuencia y canales nativos leídos de la cabecera con mutagen (sin
+    # lanzar ffprobe). Opus siempre se decodifica a 48 kHz.
+    try:
+        audio = mutagen.File(path)
+    except Exception:
+        audio = None
+    if audio is None or audio.info is None:
+        return FALLBACK_SAMPLE_RATE, FALLBACK_CHANNELS
+    channels = getattr(audio.info, "channels", None) or FALLBACK_CHANNELS
+    if isinstance(audio, OggOpus):
+        return 48000, channels
+    sample_rate = getattr(audio.info, "sample_rate", None) or FALLBACK_SAMPLE_RATE
+    return sample_rate, channels
+
+
+def ffmpeg_failure(stderr, returncode, lines=1):
+    # Motivo de un fallo de ffmpeg: sus últimas líneas de stderr (o el código
+    # de salida si no escribió nada)
+    if isinstance(stderr, bytes):
+        stderr = stderr.decode("utf-8", "replace")
+    tail = [line.strip() for line in (stderr or "").strip().splitlines()[-lines:]]
+    return " / ".join(tail) if tail else f"exit code {returncode}"
+
+
+class FfmpegProcess:
+    # Un ffmpeg con stderr en un archivo temporal (una tubería llena lo
+    # bloquearía). El with devuelve el Popen; al salir se cierran sus
+    # tuberías y se espera. Si ffmpeg falló, RuntimeError con failure y sus
+    # últimas líneas de stderr; si no, stderr queda en self.stderr.
+    def __init__(self, command, failure, lines=1, **popen_args):
+        self.command = command
+        self.failure = failure
+        self.lines = lines
+        self.popen_args = popen_args
+        self.stderr = b""
+
+    def __enter__(self):
+        self._errors = tempfile.TemporaryFile()
+        try:
+            self.process = subprocess.Popen(
+                self.command, stderr=self._errors, creationflags=STARTUP_FLAGS, **self.popen_args,
+            )
+        except BaseException:
+            self._errors.close()
+            raise
+        return self.process
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            for pipe in (self.process.stdin, self.process.stdout):
+                if pipe is not None:
+                    try:
+                        pipe.close()
+                    except BrokenPipeError:
+                        pass
+            returncode = self.process.wait()
+            self._errors.seek(0)
+            self.stderr = self._errors.read()
+        finally:
+            self._errors.close()
+        # Con una excepción en curso (o el lector que deja de leer) el código
+        # de salida no dice nada nuevo
+        if exc_type is None and returncode != 0:
+            raise RuntimeError(f"{self.failure}: {ffmpeg_failure(self.stderr, returncode, self.lines)}")
+        return False
+
+
+class PcmStream:
+    def __init__(self, path, chunk_frames=CHUNK_FRAMES):
+        self.path = path
+        self.chunk_frames = chunk_frames
+        self.sample_rate, self.channels = probe_stream(path)
+
+    def command(self):
+        return [
+            "ffmpeg", "-hide_banner", "-nostats", "-v", "error",
+            "-i", self.path,
+            "-map", "0:a:0",
+            "-f", "f32le", "-acodec", "pcm_f32le",
+            "-ar", str(self.sample_rate), "-ac", str(self.channels),
+            "-",
+        ]
+
+    def decoder(self):
+        # También lo usa la caché PCM en disco (pcm_scratch.py)
+        return FfmpegProcess(self.command(), f"ffmpeg could not decode {self.path}", stdout=subprocess.PIPE)
+
+    def __iter__(self):
+        # Cada bloque reutiliza el mismo búfer: quien lo consume no debe
+        # guardar referencias entre iteraciones
+        frame_bytes = 4 * self.channels
+        buffer = bytearray(self.chunk_frames * frame_bytes)
+        view = memoryview(buffer)
+        with self.decoder() as process:
+            while True:
+                filled = 0
+                while filled < len(buffer):
+                    count = process.stdout.readinto(view[filled:])
+                    if not count:
+                        break
+                    filled += count
+                frames = filled // frame_bytes
+                if frames:
+                    samples = np.frombuffer(buffer, dtype="<f4", count=frames * self.channels)
+                    yield samples.reshape(frames, self.channels)
+                if filled < len(buffer):
+                    break
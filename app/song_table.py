@@ -0,0 +1,323 @@
+import tkinter.ttk as ttk
+
+# ---------------------- TABLA VIRTUAL DE CANCIONES ----------------------
+#
+# Un Treeview con una fila por canción se vuelve lento con bibliotecas
+# grandes. Aquí las filas viven en un modelo (lista ordenada + diccionario
+# ruta -> valores) y el Treeview solo tiene las filas visibles, que se
+# reutilizan al desplazarse. Altas y bajas se acumulan y se redibuja una vez
+# por ciclo del mainloop. El modelo (SongModel) no usa Tk, así que se puede
+# comprobar sin pantalla.
+
+# Solo hasta que haya una fila que medir (ver measure)
+DEFAULT_ROW_HEIGHT = 20
+DEFAULT_HEADER_HEIGHT = 24
+
+
+class SongModel:
+    # Orden de las rutas, valores por ruta, rutas seleccionadas y primera fila
+    # de la ventana visible. Las bajas solo quitan la ruta del diccionario;
+    # la lista se compacta una vez, cuando vuelve a hacer falta el orden.
+    def __init__(self):
+        self.order = []
+        self.rows = {}
+        self.selected = set()
+        self.offset = 0
+        self._stale = False
+
+    def insert(self, path, values):
+        # Si la ruta ya está se actualizan sus valores en su sitio
+        if path not in self.rows:
+            self.order.append(path)
+        self.rows[path] = values
+
+    def remove_many(self, paths):
+        # Devuelve True si quitó alguna fila
+        removed = False
+        for path in paths:
+            if self.rows.pop(path, None) is not None:
+                self.selected.discard(path)
+                removed = True
+        if removed:
+            self._stale = True
+        return removed
+
+    def clear(self):
+        self.order = []
+        self.rows.clear()
+        self.selected.clear()
+        self.offset = 0
+        self._stale = False
+
+    def compact(self):
+        if self._stale:
+            self.order = [path for path in self.order if path in self.rows]
+            self._stale = False
+
+    def selection(self):
+        # Rutas seleccionadas en el orden de la tabla
+        self.compact()
+        return [path for path in self.order if path in self.selected]
+
+    def select_all(self):
+        self.selected = set(self.rows)
+
+    def __contains__(self, path):
+        return path in self.rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def window(self, size):
+        # Rutas de una ventana de size filas; si la lista ha encogido, la
+        # ventana se desplaza para seguir llena
+        self.compact()
+        self.offset = max(0, min(self.offset, len(self.order) - size))
+        return self.order[self.offset:self.offset + size]
+
+    def scroll(self, rows, size):
+        self.offset = max(0, min(self.offset + rows, len(self.rows) - size))
+
+    def move_to(self, fraction, size):
+        # Barra de desplazamiento: fracción de la lista (0-1)
+        self.offset = int(float(fraction) * len(self.rows))
+        self.scroll(0, size)
+
+    def neighbour(self, path, direction):
+        # Ruta anterior o siguiente; en los extremos, la misma
+        self.compact()
+        try:
+            index = self.order.index(path) + direction
+        except ValueError:
+            return None
+        if 0 <= index < len(self.order):
+            return self.order[index]
+        return path
+
+
+class SongTable:
+    def __init__(self, parent, columns, widths):
+        self.frame = ttk.Frame(parent)
+        self.columns = tuple(columns)
+        self.tree = ttk.Treeview(self.frame, columns=columns, show="headings", selectmode="extended", height=1)
+        for col, width in zip(columns, widths):
+            self.tree.heading(col, text=col)
+            self.tree.column(col, width=width)
+        self.scrollbar = ttk.Scrollbar(self.frame, orient="vertical", command=self.on_scrollbar)
+        self.tree.pack(side="left", expand=True, fill="both")
+        self.scrollbar.pack(side="right", fill="y")
+
+        self.model = SongModel()
+        self.visible_rows = 1
+        self.height = 0
+        # Fila visible -> ruta que muestra ahora mismo
+        self.items = {}
+        self._render_pending = False
+        self._rendering = False
+
+        style = ttk.Style()
+        self.row_height = int(style.lookup("Treeview", "rowheight") or DEFAULT_ROW_HEIGHT)
+        self.header_height = DEFAULT_HEADER_HEIGHT
+        self._measured = False
+
+        self.tree.bind("<Configure>", self.on_resize)
+        self.tree.bind("<<TreeviewSelect>>", self.on_select)
+        self.tree.bind("<Button-1>", self.on_click)
+        self.tree.bind("<MouseWheel>", self.on_wheel)
+        self.tree.bind("<Button-4>", lambda event: self.scroll(-3) or "break")
+        self.tree.bind("<Button-5>", lambda event: self.scroll(3) or "break")
+        self.tree.bind("<Up>", lambda event: self.on_arrow(event, -1))
+        self.tree.bind("<Down>", lambda event: self.on_arrow(event, 1))
+        self.tree.bind("<Prior>", lambda event: self.scroll(-self.visible_rows) or "break")
+        self.tree.bind("<Next>", lambda event: self.scroll(self.visible_rows) or "break")
+        self.tree.bind("<Control-a>", self.select_all)
+
+    # ---------- modelo ----------
+
+    def insert(self, path, values):
+        self.model.insert(path, values)
+        self.schedule_render()
+
+    def remove(self, path):
+        self.remove_many((path,))
+
+    def remove_many(self, paths):
+        if self.model.remove_many(paths):
+            self.schedule_render()
+
+    def clear(self):
+        self.model.clear()
+        self.schedule_render()
+
+    def selection(self):
+        return self.model.selection()
+
+    def __contains__(self, path):
+        return path in self.model
+
+    def __len__(self):
+        return len(self.model)
+
+    # ---------- dibujo ----------
+
+    def pack(self, **kwargs):
+        self.frame.pack(**kwargs)
+
+    def show_columns(self, columns):
+        # Columnas visibles; las filas conservan los valores de todas
+        self.tree["displaycolumns"] = columns
+
+    def bind(self, sequence, callback):
+        self.tree.bind(sequence, callback, add="+")
+
+    def winfo_exists(self):
+        return self.frame.winfo_exists()
+
+    def schedule_render(self):
+        if not self._render_pending:
+            self._render_pending = True
+            self.tree.after_idle(self.render)
+
+    def render(self):
+        self._render_pending = False
+        if not self.tree.winfo_exists():
+            return
+        window = self.model.window(self.visible_rows)
+        total = len(self.model)
+
+        # Se reutilizan los items existentes; solo se crean o borran los que
+        # sobran o faltan respecto al tamaño de la ventana
+        items = list(self.tree.get_children())
+        while len(items) < len(window):
+            items.append(self.tree.insert("", "end"))
+        if len(items) > len(window):
+            self.tree.delete(*items[len(window):])
+            items = items[:len(window)]
+
+        self._rendering = True
+        try:
+            self.items = {}
+            selected_items = []
+            for item, path in zip(items, window):
+                self.tree.item(item, values=self.model.rows[path])
+                self.items[item] = path
+                if path in self.model.selected:
+                    selected_items.append(item)
+            self.tree.selection_set(selected_items)
+        finally:
+            self._rendering = False
+
+        if total:
+            offset = self.model.offset
+            self.scrollbar.set(offset / total, min(1.0, (offset + len(window)) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+        if window:
+            # El Treeview recalcula su disposición en su propio redibujado,
+            # que ya está en la cola: la comprobación va detrás
+            self.tree.after_idle(self.check_fit)
+
+    def scroll(self, rows):
+        self.model.scroll(rows, self.visible_rows)
+        self.schedule_render()
+
+    # ---------- eventos ----------
+
+    def measure(self):
+        # Alto real de fila y de cabecera con el tema y la fuente en uso: la
+        # primera fila empieza justo debajo de la cabecera (y del borde)
+        children = self.tree.get_children()
+        box = self.tree.bbox(children[0]) if children else ""
+        if not box:
+            return False
+        self.header_height, self.row_height = box[1], max(1, box[3])
+        self._measured = True
+        return True
+
+    def fit_rows(self):
+        rows = max(1, (self.height - self.header_height) // self.row_height)
+        if rows != self.visible_rows:
+            self.visible_rows = rows
+            self.schedule_render()
+
+    def check_fit(self):
+        # La estimación no ve el borde inferior, así que se confirma con el
+        # Treeview: si hay filas que no le caben enteras, la ventana se
+        # reduce para que las últimas canciones sigan siendo alcanzables
+        if not self.tree.winfo_exists():
+            return
+        if not self._measured and self.measure():
+            self.fit_rows()
+            return
+        shown = len(self.tree.get_children())
+        first, last = self.tree.yview()
+        if shown and last < 1.0:
+            fits = max(1, int(round(last * shown)))
+            if fits < self.visible_rows:
+                self.visible_rows = fits
+                self.schedule_render()
+
+    def on_resize(self, event):
+        self.height = event.height
+        self.measure()
+        self.fit_rows()
+
+    def on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self.model.move_to(amount, self.visible_rows)
+            self.schedule_render()
+        elif action == "scroll":
+            step = self.visible_rows if unit == "pages" else 1
+            self.scroll(int(amount) * step)
+
+    def on_wheel(self, event):
+        # Windows/macOS: delta en múltiplos de 120 (o pequeño en macOS)
+        self.scroll(-3 if event.delta > 0 else 3)
+        return "break"
+
+    def on_arrow(self, event, direction):
+        # En el borde de la ventana visible se desplaza el modelo en lugar de
+        # dejar que el Treeview salga de sus propias filas
+        focus = self.tree.focus()
+        children = self.tree.get_children()
+        if not children or not focus:
+            return None
+        at_edge = focus == children[0] if direction < 0 else focus == children[-1]
+        if not at_edge:
+            return None
+        path = self.items.get(focus)
+        if not (event.state & 0x0001):
+            self.model.selected.clear()
+        self.scroll(direction)
+        self.tree.after_idle(self._focus_path, self.model.neighbour(path, direction))
+        return "break"
+
+    def _focus_path(self, path):
+        if path is None:
+            return
+        self.model.selected.add(path)
+        for item, shown in self.items.items():
+            if shown == path:
+                self.tree.focus(item)
+        self.render()
+
+    def on_click(self, event):
+        # Clic sin Ctrl/Shift: el Treeview solo limpia su selección visible,
+        # así que se limpia también la del resto del modelo
+        if not event.state & (0x0001 | 0x0004):
+            self.model.selected.clear()
+
+    def on_select(self, event):
+        if self._rendering:
+            return
+        current = set(self.tree.selection())
+        for item, path in self.items.items():
+            if item in current:
+                self.model.selected.add(path)
+            else:
+                self.model.selected.discard(path)
+
+    def select_all(self, event=None):
+        self.model.select_all()
+        self.render()
+        return "break"
@@ -0,0 +1,83 @@
+import csv
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# ---------------------- MEDICIÓN POR ETAPAS ----------------------
+#
+# Cada trabajo apunta, por etapa (análisis, codificación, metadatos...),
+# tiempo real, CPU propia, CPU de los procesos hijos (ffmpeg) y bytes
+# leídos/escritos. Los registros viajan en el resultado del trabajo y al
+# final del lote se resumen en una tabla o se exportan a JSON/CSV.
+
+CSV_FIELDS = ("path", "stage", "wall", "cpu", "child_cpu", "bytes_read", "bytes_written")
+
+
+def children_cpu():
+    # CPU de los hijos ya terminados (ffmpeg). No disponible en Windows.
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class StageTimer:
+    def __init__(self):
+        self.records = []
+
+    @contextmanager
+    def stage(self, name, bytes_read=0):
+        # El registro se puede completar dentro del bloque (bytes_written...)
+        record = {"stage": name, "bytes_read": bytes_read, "bytes_written": 0}
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        child = children_cpu()
+        try:
+            yield record
+        finally:
+            record["wall"] = time.perf_counter() - wall
+            record["cpu"] = time.process_time() - cpu
+            record["child_cpu"] = children_cpu() - child if child is not None else None
+            self.records.append(record)
+
+
+def summarize(results):
+    # Totales por etapa sobre los resultados de un lote, en orden de aparición
+    summary = {}
+    for result in results:
+        for record in result.get("timings", ()):
+            total = summary.setdefault(record["stage"], {
+                "files": 0, "wall": 0.0, "cpu": 0.0, "child_cpu": 0.0,
+                "bytes_read": 0, "bytes_written": 0,
+            })
+            total["files"] += 1
+            for key in ("wall", "cpu", "bytes_read", "bytes_written"):
+                total[key] += record[key]
+            if record["child_cpu"] is not None:
+                total["child_cpu"] += record["child_cpu"]
+    return summary
+
+
+def format_summary(summary):
+    # Tabla de texto de ancho fijo para la consola
+    lines = [f"{'stage':10s} {'files':>6s} {'wall s':>9s} {'cpu s':>8s} {'ffmpeg s':>9s} {'MB in':>8s} {'MB out':>8s}"]
+    for stage, total in summary.items():
+        lines.append(
+            f"{stage:10s} {total['files']:6d} {total['wall']:9.2f} {total['cpu']:8.2f} {total['child_cpu']:9.2f}"
+            f" {total['bytes_read'] / 1e6:8.1f} {total['bytes_written'] / 1e6:8.1f}"
+        )
+    return "\n".join(lines)
+
+
+def write_csv(results, path):
+    # Una fila por archivo y etapa
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        for result in results:
+            for record in result.get("timings", ()):
+                writer.writerow({"path": result["path"], **{key: record.get(key) for key in CSV_FIELDS[1:]}})
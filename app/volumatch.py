@@ -0,0 +1,323 @@
+import argparse
+import glob
+import json
+import math
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+
+import timing
+from analysis_cache import AnalysisCache
+from pcm_scratch import DEFAULT_BUDGET_MB, default_scratch_folder
+from core import (
+    ANALYZER_VERSION, AUDIO_EXTENSIONS, MAX_TARGET_LUFS, MIN_TARGET_LUFS, MODES, UNMEASURED_ERROR,
+    BackgroundTask, TargetSet, album_task, default_workers, iter_audio_files, normalize_task, output_paths_for, plan_task,
+)
+from watch import POLL_INTERVAL, SETTLE_SECONDS, FolderWatcher, WatchState
+
+# ---------------------- LÍNEA DE COMANDOS ----------------------
+#
+# Uso sin interfaz gráfica, pensado para lotes en servidores (cron/CI):
+#   python volumatch.py musica/ "otros/**/*.flac" --target -14 --jobs 8 --output salida/ --json informe.json
+# o como servicio que vigila carpetas de entrada:
+#   python volumatch.py entrada/ --watch --output salida/
+
+
+def expand_inputs(inputs):
+    # Archivos, carpetas (recursivas) o patrones glob; sin duplicados y en
+    # orden. Devuelve también las carpetas, cuya estructura se refleja en la
+    # salida.
+    targets = TargetSet()
+    roots = []
+    for item in inputs:
+        if os.path.isdir(item):
+            roots.append(item)
+            targets.extend(iter_audio_files(item))
+        elif os.path.isfile(item):
+            if item.lower().endswith(AUDIO_EXTENSIONS):
+                targets.add(item)
+        else:
+            for match in sorted(glob.glob(item, recursive=True)):
+                if os.path.isfile(match) and match.lower().endswith(AUDIO_EXTENSIONS):
+                    targets.add(match)
+    return list(targets), roots
+
+
+def json_safe(value):
+    # JSON estricto: -inf/nan (silencio) se escriben como null
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, dict):
+        return {key: json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_safe(item) for item in value]
+    return value
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="volumatch", description="VoluMatch — LUFS loudness normalizer (headless)")
+    parser.add_argument("inputs", nargs="+", help="audio files, directories or glob patterns")
+    parser.add_argument("--target", type=float, default=-16.0, help="target integrated loudness in LUFS (default: -16)")
+    parser.add_argument("--jobs", type=int, default=default_workers(), help="parallel worker processes (default: CPU count)")
+    parser.add_argument("--mode", choices=MODES, default="loudnorm", help="loudnorm re-encode, lossless mp3gain, or tags only")
+    parser.add_argument("--tolerance", type=float, default=0.0, metavar="LU",
+                        help="link or copy tracks already within this many LU of the target instead of processing them (default: 0, off)")
+    parser.add_argument("--album", action="store_true",
+                        help="album gain: one common gain per album (album tags or folder) instead of per track")
+    parser.add_argument("--plan", action="store_true",
+                        help="only show the gain, predicted peak and clipping for the target, from stored analyses")
+    parser.add_argument("--output", help="output folder (required unless --mode tags)")
+    parser.add_argument("--json", dest="json_path", help="write machine-readable results to this file ('-' for stdout)")
+    parser.add_argument("--timings-csv", help="write per-file, per-stage timings to this CSV file")
+    parser.add_argument("--verify-sample", type=float, default=0.0, metavar="FRACTION",
+                        help="re-decode and measure this fraction of outputs (0-1, default: 0)")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running: watch the input directories and normalize files as they arrive")
+    parser.add_argument("--settle", type=float, default=SETTLE_SECONDS, metavar="SECONDS",
+                        help="with --watch, wait until a file has not changed for this long (default: %(default)s)")
+    parser.add_argument("--poll", type=float, metavar="SECONDS",
+                        help="with --watch, scan every SECONDS instead of using inotify")
+    parser.add_argument("--state", help="with --watch, database of processed files (default: user cache directory)")
+    parser.add_argument("--scratch", nargs="?", const=default_scratch_folder(), metavar="DIR",
+                        help="decode each input once to raw PCM in DIR and reuse it for analysis and encoding "
+                             "(default DIR: system temp folder)")
+    parser.add_argument("--scratch-budget", type=float, default=DEFAULT_BUDGET_MB, metavar="MB",
+                        help="maximum size of the --scratch folder (default: %(default)s MB)")
+    parser.add_argument("--cache", help="analysis cache database (default: user cache directory)")
+    parser.add_argument("--no-cache", action="store_true", help="do not read or write the analysis cache")
+    args = parser.parse_args(argv)
+    if args.mode != "tags" and not args.output and not args.plan:
+        parser.error("--output is required unless --mode tags")
+    if not MIN_TARGET_LUFS <= args.target <= MAX_TARGET_LUFS:
+        parser.error(f"--target must be between {MIN_TARGET_LUFS:g} and {MAX_TARGET_LUFS:g} LUFS")
+    if args.tolerance < 0:
+        parser.error("--tolerance must not be negative")
+    if not 0.0 <= args.verify_sample <= 1.0:
+        parser.error("--verify-sample must be between 0 and 1")
+    if args.watch and (args.album or args.plan):
+        parser.error("--album and --plan cannot be combined with --watch")
+    if args.watch:
+        missing = [item for item in args.inputs if not os.path.isdir(item)]
+        if missing:
+            parser.error(f"--watch needs directories: {', '.join(missing)}")
+    args.jobs = max(1, args.jobs)
+    return args
+
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def format_result(result):
+    if not result["ok"]:
+        return f"✗ {result.get('error')}"
+    before = result["before"]["lufs"]
+    if result.get("skipped"):
+        return f"= {before:.2f} LUFS, within tolerance ({result['skipped']})"
+    after = result.get("after")
+    if after is None:
+        line = f"✓ {before:.2f} LUFS, gain {result['gain']:+.2f} dB"
+    else:
+        line = f"✓ {before:.2f} → {after['lufs']:.2f} LUFS"
+    verified = result.get("verified")
+    if verified is not None:
+        line += f" (verified {verified['lufs']:.2f} LUFS)"
+    album = result.get("album")
+    if album is not None:
+        line += f" [album {album['lufs']:.2f} LUFS, {album['tracks']} tracks, gain {album['gain']:+.2f} dB]"
+    return line
+
+
+def format_plan(result):
+    if not result["ok"]:
+        return f"✗ {result.get('error')}"
+    before = result["before"]
+    plan = result["plan"]
+    if plan["gain"] is None:
+        return f"{UNMEASURED_ERROR}, no gain"
+    line = f"{before['lufs']:.2f} LUFS, gain {plan['gain']:+.2f} dB → {plan['lufs']:.2f} LUFS, peak {plan['true_peak']:.2f} dBTP"
+    if plan["over_seconds"]:
+        line += f", {plan['over_seconds']:.1f} s over the ceiling"
+    if "linear" in plan and not plan["linear"]:
+        line += " (limiter)"
+    if before.get("sparkline"):
+        line += f"  {before['sparkline']}"
+    return line
+
+
+def plan_main(args, paths):
+    # Solo consulta: con los análisis en la caché es instantáneo para
+    # cualquier objetivo
+    cache = open_cache(args)
+    events = queue.Queue()
+    task = BackgroundTask(events, plan_task, paths, cache, args.jobs, args.target, args.mode)
+    results = []
+    try:
+        while True:
+            try:
+                event = events.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if event[0] == "planned":
+                result = event[1]
+                results.append(result)
+                log(f"{result['path']}: {format_plan(result)}")
+            elif event[0] == "plan_done":
+                break
+    except KeyboardInterrupt:
+        task.cancel()
+        task.thread.join()
+    finally:
+        if cache is not None:
+            cache.close()
+
+    if args.json_path:
+        report = json_safe({"target_lufs": args.target, "mode": args.mode, "results": results})
+        if args.json_path == "-":
+            json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+            sys.stdout.write("\n")
+        else:
+            with open(args.json_path, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+    return 1 if any(not result["ok"] for result in results) else 0
+
+
+def job_options(args):
+    return {
+        "target_lufs": args.target,
+        "mode": args.mode,
+        "tolerance": args.tolerance,
+        "verify_fraction": args.verify_sample,
+        "scratch": {"folder": args.scratch, "budget_mb": args.scratch_budget} if args.scratch else None,
+    }
+
+
+def open_cache(args):
+    if args.no_cache:
+        return None
+    try:
+        return AnalysisCache(args.cache, analyzer_version=ANALYZER_VERSION)
+    except Exception as e:
+        log(f"Could not open analysis cache: {e}")
+        return None
+
+
+def watch_main(args):
+    cache = open_cache(args)
+    state = WatchState(args.state)
+    watcher = FolderWatcher(
+        args.inputs, args.output, job_options(args), args.jobs, cache, state,
+        settle=args.settle, poll_interval=args.poll or POLL_INTERVAL, force_polling=args.poll is not None,
+        report=lambda result: log(f"{result['path']}: {format_result(result)}"),
+    )
+    # Como servicio (systemd, docker stop) se para con SIGTERM
+    signal.signal(signal.SIGTERM, lambda *_: watcher.stop())
+    thread = threading.Thread(target=watcher.run, daemon=True)
+    thread.start()
+    log(f"Watching {', '.join(args.inputs)}, mode {args.mode}, target {args.target} LUFS (Ctrl+C to stop)")
+    try:
+        while thread.is_alive():
+            thread.join(0.5)
+    except KeyboardInterrupt:
+        log("Stopping: waiting for running files to finish...")
+        watcher.stop()
+        thread.join()
+    finally:
+        state.close()
+        if cache is not None:
+            cache.close()
+    return 0
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.watch:
+        return watch_main(args)
+    paths, roots = expand_inputs(args.inputs)
+    if not paths:
+        log("No audio files found.")
+        return 2
+    if args.plan:
+        return plan_main(args, paths)
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    cache = open_cache(args)
+    outputs = output_paths_for(paths, args.mode, args.output, roots)
+    jobs = [dict(
+        job_options(args),
+        path=path,
+        output_path=outputs[path],
+        analysis=None,
+    ) for path in paths]
+
+    log(f"{len(jobs)} files, mode {args.mode}{' (album)' if args.album else ''}, target {args.target} LUFS, {args.jobs} workers")
+    events = queue.Queue()
+    task = BackgroundTask(events, album_task if args.album else normalize_task, jobs, cache, args.jobs)
+    results = []
+    cancelled = False
+    try:
+        while True:
+            try:
+                event = events.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            except KeyboardInterrupt:
+                # Primer Ctrl+C: no se empiezan más archivos y los que estaban
+                # en curso (ffmpeg también recibe la señal) se esperan y se
+                # informan. El segundo sale ya.
+                if task.is_cancelled():
+                    raise
+                log("Cancelling: no new files will start; waiting for running ones (Ctrl+C again to quit)...")
+                task.cancel()
+                continue
+            if event[0] == "normalized":
+                result = event[1]
+                results.append(result)
+                log(f"[{len(results)}/{len(jobs)}] {os.path.basename(result['path'])}: {format_result(result)}")
+            elif event[0] == "normalize_done":
+                cancelled = event[1]
+                break
+    finally:
+        if cache is not None:
+            cache.close()
+
+    ok = sum(1 for result in results if result["ok"])
+    errors = len(results) - ok
+    skipped = sum(1 for result in results if result.get("skipped"))
+    log(f"Done: {ok} ok ({skipped} skipped), {errors} errors" + (", cancelled" if cancelled else ""))
+    summary = timing.summarize(results)
+    if summary:
+        log(timing.format_summary(summary))
+    if args.timings_csv:
+        timing.write_csv(results, args.timings_csv)
+
+    if args.json_path:
+        report = json_safe({
+            "target_lufs": args.target,
+            "mode": args.mode,
+            "tolerance": args.tolerance,
+            "album": args.album,
+            "ok": ok,
+            "skipped": skipped,
+            "errors": errors,
+            "cancelled": cancelled,
+            "timings": summary,
+            "results": results,
+        })
+        if args.json_path == "-":
+            json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+            sys.stdout.write("\n")
+        else:
+            with open(args.json_path, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+    return 1 if errors or cancelled else 0
+
+
+if __name__ == "__main__":
+    # Necesario para el pool de procesos en un ejecutable de PyInstaller
+    multiprocessing.freeze_support()
+    sys.exit(main())
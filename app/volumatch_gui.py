@@ -0,0 +1,12 @@
+import multiprocessing
+
+# Punto de entrada de la app Tk (y del .exe de PyInstaller). Con spawn
+# (Windows, macOS) cada proceso del pool vuelve a importar este archivo como
+# __mp_main__, y en el .exe lo ejecuta hasta freeze_support. Por eso aquí no
+# se importa nada más: la interfaz (tkinter, PIL) se carga solo en el proceso
+# principal y los trabajadores importan únicamente core.
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    from VolumeNormalizerApp import main
+    main()
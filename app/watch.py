@@ -0,0 +1,398 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import sqlite3
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from analysis_cache import default_cache_path
+from core import (
+    AUDIO_EXTENSIONS, ignore_interrupts, iter_audio_files, path_key, normalize_track, output_paths_for, unique_output_path,
+)
+from output_staging import cleanup_orphans, is_staging_file
+
+# ---------------------- CARPETAS VIGILADAS ----------------------
+#
+# Modo continuo: se vigilan carpetas de entrada (inotify en Linux, sondeo en
+# el resto), se espera a que cada archivo deje de cambiar y se normaliza con
+# el mismo motor que los lotes. Lo ya procesado se recuerda en SQLite, así que
+# al reiniciar solo se procesa lo nuevo o modificado.
+
+SETTLE_SECONDS = 2.0
+POLL_INTERVAL = 2.0
+TICK_SECONDS = 0.5
+# Reintentos de archivos que fallaron (carpeta de salida sin conexión, falta
+# ffmpeg...): la espera se duplica en cada fallo hasta el máximo
+RETRY_SECONDS = 30.0
+MAX_RETRY_SECONDS = 3600.0
+
+STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    output_path TEXT,
+    ok INTEGER NOT NULL,
+    processed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outputs (
+    output_key TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    output_path TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outputs_path ON outputs (path);
+"""
+
+
+def default_state_path():
+    return os.path.join(os.path.dirname(default_cache_path()), "watch.sqlite3")
+
+
+class WatchState:
+    # Archivos ya procesados, con el tamaño y mtime que tenían al terminar, y
+    # la salida asignada a cada entrada
+    def __init__(self, db_path=None):
+        self.db_path = db_path or default_state_path()
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        # Se abre en un hilo y se usa en el del vigilante
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(STATE_SCHEMA)
+
+    def is_processed(self, path, st):
+        # Solo cuenta lo que terminó bien: un fallo se vuelve a intentar
+        row = self.conn.execute(
+            "SELECT size, mtime_ns FROM processed WHERE path = ? AND ok = 1", (path_key(path),)
+        ).fetchone()
+        return row is not None and row[0] == st.st_size and row[1] == st.st_mtime_ns
+
+    def reserve_output(self, path, output_path):
+        # Cada entrada conserva siempre su salida; si otra ya tiene ese nombre
+        # (x.mp3 y x.flac con loudnorm) se numera, como en los lotes
+        key = path_key(path)
+        row = self.conn.execute("SELECT output_path FROM outputs WHERE path = ?", (key,)).fetchone()
+        if row is not None:
+            return row[0]
+
+        def is_taken(output):
+            return self.conn.execute(
+                "SELECT 1 FROM outputs WHERE output_key = ?", (path_key(output),)
+            ).fetchone() is not None
+
+        output_path = unique_output_path(output_path, is_taken)
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO outputs (output_key, path, output_path) VALUES (?, ?, ?)",
+                (path_key(output_path), key, output_path),
+            )
+        return output_path
+
+    def mark(self, path, st, output_path, ok):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO processed (path, size, mtime_ns, output_path, ok, processed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (path_key(path), st.st_size, st.st_mtime_ns, output_path, int(ok), time.time()),
+            )
+
+    def close(self):
+        self.conn.close()
+
+
+# ---------------------- INOTIFY (ctypes) ----------------------
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0)
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_MOVE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def walk_dirs(folder):
+    for current, dirs, _ in os.walk(folder):
+        yield current
+
+
+def scan_files(folder):
+    return iter_audio_files(folder)
+
+
+class InotifyBackend:
+    # Devuelve rutas que pueden haber cambiado; la estabilidad la decide el
+    # vigilante. Lanza OSError si inotify no está disponible o se agotan los
+    # watches (fs.inotify.max_user_watches), y entonces se usa el sondeo.
+    def __init__(self, folders):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+        self.folders = folders
+        try:
+            for folder in folders:
+                self.watch_tree(folder)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def watch_tree(self, folder):
+        for current in walk_dirs(folder):
+            wd = self._add_watch(self.fd, os.fsencode(current), WATCH_MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, f"inotify_add_watch failed for {current}: {os.strerror(errno)}")
+            self.watches[wd] = current
+
+    def initial_scan(self):
+        for folder in self.folders:
+            yield from scan_files(folder)
+
+    def changes(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return []
+
+        paths = []
+        pos = 0
+        while pos + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, pos)
+            name = data[pos + EVENT_HEADER.size:pos + EVENT_HEADER.size + length].rstrip(b"\0")
+            pos += EVENT_HEADER.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                # Se perdieron eventos: volver a recorrer todo
+                paths.extend(self.initial_scan())
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            folder = self.watches.get(wd)
+            if folder is None or not name:
+                continue
+            path = os.path.join(folder, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # Carpeta nueva: vigilarla y recoger lo que ya contenga
+                    try:
+                        self.watch_tree(path)
+                    except OSError as e:
+                        print(f"Error watching {path}: {e}", file=sys.stderr)
+                    paths.extend(scan_files(path))
+                continue
+            paths.append(path)
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingBackend:
+    # Recorre las carpetas cada interval segundos y compara tamaño y mtime
+    def __init__(self, folders, interval=POLL_INTERVAL):
+        self.folders = folders
+        self.interval = interval
+        self.snapshot = {}
+        self.next_scan = 0.0
+
+    def scan(self):
+        snapshot = {}
+        for folder in self.folders:
+            for path in scan_files(folder):
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[path] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    def initial_scan(self):
+        self.snapshot = self.scan()
+        self.next_scan = time.monotonic() + self.interval
+        return list(self.snapshot)
+
+    def changes(self, timeout):
+        delay = self.next_scan - time.monotonic()
+        if delay > 0:
+            time.sleep(min(delay, timeout))
+            return []
+        snapshot = self.scan()
+        changed = [path for path, key in snapshot.items() if self.snapshot.get(path) != key]
+        self.snapshot = snapshot
+        self.next_scan = time.monotonic() + self.interval
+        return changed
+
+    def close(self):
+        pass
+
+
+def make_backend(folders, poll_interval=POLL_INTERVAL, force_polling=False):
+    if sys.platform.startswith("linux") and not force_polling:
+        try:
+            return InotifyBackend(folders)
+        except (OSError, AttributeError) as e:
+            print(f"inotify unavailable, falling back to polling: {e}", file=sys.stderr)
+    return PollingBackend(folders, poll_interval)
+
+
+# ---------------------- VIGILANTE ----------------------
+
+class FolderWatcher:
+    def __init__(self, folders, output_folder, job_options, workers, cache=None, state=None,
+                 settle=SETTLE_SECONDS, poll_interval=POLL_INTERVAL, force_polling=False, report=print):
+        # job_options: target_lufs, mode, tolerance... (los campos de un trabajo
+        # de normalize_track salvo path, output_path y analysis)
+        self.folders = [os.path.abspath(folder) for folder in folders]
+        self.output_folder = output_folder
+        self.job_options = job_options
+        self.workers = workers
+        self.cache = cache
+        self.state = state or WatchState()
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.force_polling = force_polling
+        self.report = report
+        self.stop_event = threading.Event()
+        # Ruta -> (tamaño, mtime_ns, momento del último cambio)
+        self.pending = {}
+        self.running = {}
+        # Ruta -> fallos seguidos, y ruta -> momento del próximo intento
+        self.failures = {}
+        self.retry_at = {}
+        self.excluded = path_key(output_folder) if output_folder else None
+
+    def stop(self):
+        self.stop_event.set()
+
+    def wanted(self, path):
+        name = os.path.basename(path)
+        if is_staging_file(name) or not name.lower().endswith(AUDIO_EXTENSIONS):
+            return False
+        # Si la carpeta de salida está dentro de la vigilada, no se reprocesa
+        key = path_key(path)
+        return not (self.excluded and key.startswith(self.excluded + os.sep))
+
+    def output_path(self, path):
+        # Se conserva la estructura de subcarpetas bajo la carpeta de salida
+        mode = self.job_options.get("mode", "loudnorm")
+        if mode == "tags":
+            return path
+        output = output_paths_for([path], mode, self.output_folder, self.folders)[path]
+        return self.state.reserve_output(path, output)
+
+    def note(self, path):
+        if path in self.running or not self.wanted(path):
+            return
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.pending.pop(path, None)
+            return
+        if self.state.is_processed(path, st):
+            self.pending.pop(path, None)
+            return
+        current = self.pending.get(path)
+        if current is None or current[:2] != (st.st_size, st.st_mtime_ns):
+            self.pending[path] = (st.st_size, st.st_mtime_ns, time.monotonic())
+
+    def ready_paths(self):
+        # Un archivo está listo cuando su tamaño y mtime no cambian durante
+        # settle segundos (copias lentas por red, subidas a medias...)
+        now = time.monotonic()
+        ready = []
+        for path, (size, mtime_ns, since) in list(self.pending.items()):
+            try:
+                st = os.stat(path)
+            except OSError:
+                del self.pending[path]
+                continue
+            if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                self.pending[path] = (st.st_size, st.st_mtime_ns, now)
+            elif now - since >= self.settle and st.st_size > 0:
+                del self.pending[path]
+                ready.append(path)
+        return ready
+
+    def due_retries(self):
+        now = time.monotonic()
+        due = [path for path, when in self.retry_at.items() if when <= now]
+        for path in due:
+            del self.retry_at[path]
+        return due
+
+    def submit(self, pool, path):
+        # Aquí solo la consulta barata; la búsqueda por hash la hace el trabajo
+        analysis = self.cache.lookup(path) if self.cache is not None else None
+        job = dict(self.job_options, path=path, output_path=self.output_path(path), analysis=analysis)
+        if analysis is None and self.cache is not None:
+            job["cache"] = self.cache.worker_options()
+        self.running[path] = pool.submit(normalize_track, job)
+
+    def collect(self, done):
+        for path, future in list(self.running.items()):
+            if future not in done:
+                continue
+            del self.running[path]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"path": path, "ok": False, "error": str(e)}
+            # Se guarda el estado del archivo tras el trabajo: el modo de
+            # etiquetas lo reescribe y no debe volver a dispararse
+            try:
+                self.state.mark(path, os.stat(path), result.get("output_path"), result["ok"])
+            except OSError:
+                pass
+            if result["ok"]:
+                self.failures.pop(path, None)
+            else:
+                failures = self.failures.get(path, 0) + 1
+                self.failures[path] = failures
+                delay = min(MAX_RETRY_SECONDS, RETRY_SECONDS * 2 ** min(failures - 1, 10))
+                self.retry_at[path] = time.monotonic() + delay
+            self.report(result)
+
+    def run(self):
+        if self.output_folder:
+            os.makedirs(self.output_folder, exist_ok=True)
+            cleanup_orphans(self.output_folder)
+        backend = make_backend(self.folders, self.poll_interval, self.force_polling)
+        pool = ProcessPoolExecutor(max_workers=self.workers, initializer=ignore_interrupts)
+        try:
+            # Lo que llegó mientras no se vigilaba
+            for path in backend.initial_scan():
+                self.note(path)
+            while not self.stop_event.is_set():
+                for path in backend.changes(TICK_SECONDS):
+                    self.note(path)
+                for path in self.due_retries():
+                    self.note(path)
+                for path in self.ready_paths():
+                    self.submit(pool, path)
+                if self.running:
+                    done, _ = wait(list(self.running.values()), timeout=0, return_when=FIRST_COMPLETED)
+                    self.collect(done)
+        finally:
+            backend.close()
+            # Los trabajos en curso terminan; los que esperan se descartan y
+            # se retomarán en el próximo arranque
+            pool.shutdown(wait=True, cancel_futures=True)
+            self.collect({future for future in self.running.values() if future.done() and not future.cancelled()})
@@ -0,0 +1,213 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "app"))
+
+from corpus import build_corpus  # noqa: E402
+from core import analyze_track, get_rms, normalize_with_ffmpeg_loudnorm, TargetSet  # noqa: E402
+from pcm_stream import PcmStream  # noqa: E402
+
+# ---------------------- BENCHMARKS ----------------------
+#
+# Mide cada etapa sobre el corpus sintético y la compara con una línea base
+# guardada:
+#   python bench/benchmark.py                      # perfil rápido
+#   python bench/benchmark.py --profile full       # incluye pistas de horas
+#   python bench/benchmark.py --save-baseline      # guarda la línea base
+# Sale con código 1 si alguna etapa es más lenta que la base más allá del
+# umbral.
+
+DEFAULT_CORPUS = os.path.join(BENCH_DIR, "corpus")
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+DEFAULT_THRESHOLD = 0.15
+TABLE_ROWS = 100_000
+
+
+def stage_decode(track, workdir):
+    for _ in PcmStream(track["path"]):
+        pass
+
+
+def stage_analyze(track, workdir):
+    analyze_track(track["path"])
+
+
+def stage_rms(track, workdir):
+    # get_rms sobre un AudioSegment de pydub (solo se cronometra el cálculo)
+    from pydub import AudioSegment
+    audio = AudioSegment.from_file(track["path"])
+    start = time.perf_counter()
+    get_rms(audio)
+    return time.perf_counter() - start
+
+
+def stage_encode(track, workdir):
+    analysis = track.get("analysis") or analyze_track(track["path"])
+    track["analysis"] = analysis
+    output = os.path.join(workdir, track["name"] + ".mp3")
+    start = time.perf_counter()
+    normalize_with_ffmpeg_loudnorm(track["path"], output, -16.0, analysis)
+    return time.perf_counter() - start
+
+
+STAGES = {
+    "decode": stage_decode,
+    "analyze": stage_analyze,
+    "rms": stage_rms,
+    "encode": stage_encode,
+}
+# Pistas a partir de esta duración se omiten en las etapas que cargan el
+# archivo entero en memoria
+MAX_IN_MEMORY_SECONDS = {"rms": 1800}
+
+
+def run_stage(name, tracks, workdir, log):
+    func = STAGES[name]
+    wall = 0.0
+    audio_seconds = 0.0
+    files = 0
+    for track in tracks:
+        if track["seconds"] > MAX_IN_MEMORY_SECONDS.get(name, float("inf")):
+            continue
+        start = time.perf_counter()
+        measured = func(track, workdir)
+        elapsed = measured if measured is not None else time.perf_counter() - start
+        wall += elapsed
+        audio_seconds += track["seconds"]
+        files += 1
+        log(f"  {name:8s} {track['name']:16s} {elapsed:8.3f} s  ({track['seconds'] / elapsed:7.1f}x realtime)")
+    return {
+        "files": files,
+        "wall": wall,
+        "audio_seconds": audio_seconds,
+        "files_per_s": files / wall if wall else 0.0,
+        "realtime": audio_seconds / wall if wall else 0.0,
+    }
+
+
+def run_table_stage(log):
+    # Modelo de la tabla de canciones y de la lista de objetivos con muchas
+    # filas; la parte de Tk solo si hay pantalla
+    paths = [f"/music/artist{i // 1000}/album{i // 50}/{i:06d}.mp3" for i in range(TABLE_ROWS)]
+    start = time.perf_counter()
+    targets = TargetSet(paths)
+    targets.extend(paths)
+    for path in paths[::2]:
+        targets.discard(path)
+    wall = time.perf_counter() - start
+    try:
+        import tkinter as tk
+        from song_table import SongTable
+        root = tk.Tk()
+    except Exception as e:
+        # Sin pantalla se mide solo el modelo de la tabla
+        from song_table import SongModel
+        log(f"  table    Tk not available ({e}); only the table model measured")
+        model = SongModel()
+        start = time.perf_counter()
+        for path in paths:
+            model.insert(path, (path, "60.0s", "-18.0 dBFS", "-16.0 LUFS"))
+        model.window(40)
+        model.remove_many(paths[::2])
+        model.window(40)
+        wall += time.perf_counter() - start
+    else:
+        root.withdraw()
+        table = SongTable(root, ("file", "duration", "RMS", "LUFS"), [250, 100, 100, 100])
+        start = time.perf_counter()
+        for path in paths:
+            table.insert(path, (path, "60.0s", "-18.0 dBFS", "-16.0 LUFS"))
+        table.render()
+        for path in paths[::2]:
+            table.remove(path)
+        table.render()
+        wall += time.perf_counter() - start
+        root.destroy()
+    log(f"  table    {TABLE_ROWS} rows {wall:8.3f} s")
+    return {"files": TABLE_ROWS, "wall": wall, "audio_seconds": 0.0,
+            "files_per_s": TABLE_ROWS / wall if wall else 0.0, "realtime": 0.0}
+
+
+def compare(results, baseline, threshold, log):
+    # Regresión: files/s por debajo de la base en más de threshold
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base or not base.get("files_per_s"):
+            continue
+        change = result["files_per_s"] / base["files_per_s"] - 1
+        status = "REGRESSION" if change < -threshold else "ok"
+        log(f"{name:8s} {result['files_per_s']:10.2f} files/s  base {base['files_per_s']:10.2f}  {change:+7.1%}  {status}")
+        if status != "ok":
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="VoluMatch benchmarks")
+    parser.add_argument("--profile", choices=("quick", "full"), default="quick")
+    parser.add_argument("--stages", default="decode,analyze,rms,encode,table",
+                        help="comma-separated stages (default: %(default)s)")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="corpus folder (generated if missing)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed slowdown before failing (default: %(default)s = 15%%)")
+    parser.add_argument("--json", dest="json_path", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    def log(message):
+        print(message, flush=True)
+
+    tracks = build_corpus(args.corpus, args.profile, log)
+    workdir = tempfile.mkdtemp(prefix="volumatch-bench-")
+    results = {}
+    try:
+        for name in args.stages.split(","):
+            name = name.strip()
+            log(f"{name}:")
+            if name == "table":
+                results[name] = run_table_stage(log)
+            else:
+                results[name] = run_stage(name, tracks, workdir, log)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    log("")
+    log(f"{'stage':8s} {'files':>6s} {'wall s':>9s} {'files/s':>9s} {'realtime':>9s}")
+    for name, result in results.items():
+        log(f"{name:8s} {result['files']:6d} {result['wall']:9.3f} {result['files_per_s']:9.2f} {result['realtime']:8.1f}x")
+
+    report = {"profile": args.profile, "python": sys.version.split()[0], "results": results}
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        log(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    try:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    except OSError:
+        log("\nNo baseline found (use --save-baseline)")
+        return 0
+    if baseline.get("profile") != args.profile:
+        log(f"\nBaseline is for profile {baseline.get('profile')}; not comparing")
+        return 0
+    log("")
+    regressions = compare(results, baseline["results"], args.threshold, log)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
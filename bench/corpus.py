@@ -0,0 +1,122 @@
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+# ---------------------- CORPUS SINTÉTICO ----------------------
+#
+# Genera con NumPy y el ffmpeg local un conjunto de archivos reproducible
+# (misma semilla, mismo audio): tonos, ruido rosa, pistas con mucho
+# silencio, mono/estéreo, 44.1/48 kHz y duraciones desde segundos hasta
+# horas. El audio se genera por bloques y se envía a ffmpeg por una
+# tubería, así que las pistas largas no ocupan memoria.
+
+SEED = 1770
+BLOCK_SECONDS = 10
+CORPUS_VERSION = 1
+
+# nombre, tipo, segundos, frecuencia, canales, formato
+PROFILES = {
+    "quick": [
+        ("tone_short", "tone", 5, 44100, 2, "mp3"),
+        ("pink_stereo", "pink", 60, 44100, 2, "mp3"),
+        ("pink_mono_48k", "pink", 60, 48000, 1, "mp3"),
+        ("silence_heavy", "sparse", 60, 44100, 2, "mp3"),
+        ("pink_flac_48k", "pink", 60, 48000, 2, "flac"),
+        ("tone_sweep", "sweep", 30, 48000, 2, "mp3"),
+    ],
+    "full": [
+        ("tone_short", "tone", 5, 44100, 2, "mp3"),
+        ("pink_stereo", "pink", 60, 44100, 2, "mp3"),
+        ("pink_mono_48k", "pink", 60, 48000, 1, "mp3"),
+        ("silence_heavy", "sparse", 60, 44100, 2, "mp3"),
+        ("pink_flac_48k", "pink", 60, 48000, 2, "flac"),
+        ("tone_sweep", "sweep", 30, 48000, 2, "mp3"),
+        ("album_track", "pink", 240, 44100, 2, "mp3"),
+        ("dj_mix", "pink", 3600, 44100, 2, "mp3"),
+        ("audiobook", "sparse", 2 * 3600, 48000, 1, "mp3"),
+    ],
+}
+
+
+def pink_block(rng, frames, channels):
+    # Ruido blanco con espectro 1/f aplicado por FFT
+    white = rng.standard_normal((frames, channels))
+    spectrum = np.fft.rfft(white, axis=0)
+    scale = 1 / np.sqrt(np.maximum(np.arange(len(spectrum)), 1))
+    pink = np.fft.irfft(spectrum * scale[:, None], frames, axis=0)
+    return 0.25 * pink / (np.abs(pink).max() + 1e-12)
+
+
+def generate_block(kind, rng, start, frames, sample_rate, channels):
+    t = (start + np.arange(frames)) / sample_rate
+    if kind == "tone":
+        block = 0.5 * np.sin(2 * np.pi * 1000 * t)[:, None].repeat(channels, axis=1)
+    elif kind == "sweep":
+        # Barrido lento de 50 Hz a 10 kHz, periódico cada 20 s
+        phase = 2 * np.pi * 50 * 20 / np.log(200) * (200 ** ((t % 20) / 20) - 1)
+        block = 0.5 * np.sin(phase)[:, None].repeat(channels, axis=1)
+    elif kind == "sparse":
+        # Voz simulada: ráfagas de ruido rosa separadas por silencios largos
+        block = pink_block(rng, frames, channels)
+        gate = (np.sin(2 * np.pi * t / 7.0) > 0.6) & (np.sin(2 * np.pi * t / 1.3) > -0.2)
+        block *= gate[:, None]
+    else:
+        block = pink_block(rng, frames, channels)
+    return block.astype("<f4")
+
+
+def encode_command(path, sample_rate, channels, fmt):
+    codec = ["-c:a", "flac"] if fmt == "flac" else ["-c:a", "libmp3lame", "-b:a", "192k"]
+    return [
+        "ffmpeg", "-v", "error", "-y",
+        "-f", "f32le", "-ar", str(sample_rate), "-ac", str(channels), "-i", "pipe:0",
+        *codec, path,
+    ]
+
+
+def write_track(path, kind, seconds, sample_rate, channels, fmt, seed):
+    rng = np.random.default_rng(seed)
+    process = subprocess.Popen(encode_command(path, sample_rate, channels, fmt), stdin=subprocess.PIPE)
+    total = int(seconds * sample_rate)
+    block_frames = BLOCK_SECONDS * sample_rate
+    try:
+        for start in range(0, total, block_frames):
+            frames = min(block_frames, total - start)
+            process.stdin.write(generate_block(kind, rng, start, frames, sample_rate, channels).tobytes())
+    finally:
+        process.stdin.close()
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg could not encode {path}")
+
+
+def build_corpus(folder, profile="quick", log=print):
+    # Devuelve la lista de pistas; solo genera las que faltan o cambiaron
+    os.makedirs(folder, exist_ok=True)
+    manifest_path = os.path.join(folder, "manifest.json")
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+
+    tracks = []
+    for index, (name, kind, seconds, sample_rate, channels, fmt) in enumerate(PROFILES[profile]):
+        path = os.path.join(folder, f"{name}.{fmt}")
+        spec = [CORPUS_VERSION, kind, seconds, sample_rate, channels, fmt]
+        if manifest.get(name) != spec or not os.path.exists(path):
+            log(f"generating {os.path.basename(path)} ({seconds} s)")
+            write_track(path, kind, seconds, sample_rate, channels, fmt, SEED + index)
+            manifest[name] = spec
+            with open(manifest_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, indent=2)
+        tracks.append({"path": path, "name": name, "seconds": seconds,
+                       "sample_rate": sample_rate, "channels": channels, "format": fmt})
+    return tracks
+
+
+if __name__ == "__main__":
+    target = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), "corpus")
+    build_corpus(target, sys.argv[2] if len(sys.argv) > 2 else "quick")